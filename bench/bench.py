@@ -0,0 +1,268 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+bench
+
+In-process throughput benchmark of the message path.  A Controller is
+created against a fake Polyglot with the devices of devtest /
+devtest_large plus a few synthetic multi-sensor Tasmota boards, and
+synthetic traffic for every device type is pushed through _on_message.
+
+Per device type it reports messages per second and p50 / p99 latency of
+one message (processed inline, on the calling thread), and, from a
+separate traced pass, the memory one message allocates: the peak traced
+memory above what was held when the message arrived, averaged over the
+messages, and the peak of the whole pass.  A final pass runs the mixed traffic
+through the real WorkerPool.
+
+    python bench/bench.py [--devices devtest_large] [--messages 2000] [--output bench_output.txt]
+
+udi_interface writes its log to ./logs, run it from a scratch directory
+if that is not wanted.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import udi_interface
+from nodes import Controller, StatusBatcher, WorkerPool
+from fakes import FakePolyglot, FakeMessage, FakeMqttClient, InlinePool
+
+LOGGER = udi_interface.LOGGER
+OUT = sys.__stdout__  # udi_interface redirects sys.stdout into its log
+
+
+def tasmota_boards(count):
+    """ ESP boards with two DS18B20, an AM2301, a BME280 and an analog input each """
+    devices = []
+    for board in range(count):
+        base = f'bench{board}'
+        for sensor_id, dev_type in (('DS18B20-1', 'Temp'), ('DS18B20-2', 'Temp'), ('AM2301', 'TempHumid'),
+                                    ('BME280', 'TempHumidPress'), ('A0', 'analog')):
+            devices.append({'id': f'{base}{sensor_id.replace("-", "")}'[:14], 'type': dev_type,
+                            'sensor_id': sensor_id, 'status_topic': f'tele/{base}/SENSOR',
+                            'cmd_topic': f'cmnd/{base}/power'})
+    return devices
+
+
+def load_devices(path, boards):
+    with open(path) as f:
+        devices = json.load(f)
+    for dev in devices:
+        if dev['type'] == 'shellyflood' and isinstance(dev['status_topic'], str) \
+                and not dev['status_topic'].endswith(('+', '#')):
+            # one topic per reading on a real Shelly
+            dev['status_topic'] += '/+'
+    return devices + tasmota_boards(boards)
+
+
+def tasmota_sensor(i):
+    return json.dumps({
+        'Time': '2024-01-01T00:00:00',
+        'DS18B20-1': {'Id': '0316A279B5FF', 'Temperature': 20 + i % 10 / 10},
+        'DS18B20-2': {'Id': '0316A279B6FF', 'Temperature': 21 + i % 10 / 10},
+        'AM2301': {'Temperature': 22.1, 'Humidity': 40 + i % 20, 'DewPoint': 8.3},
+        'BME280': {'Temperature': 22.4, 'Humidity': 41.2, 'DewPoint': 8.6, 'Pressure': 1000 + i % 30},
+        'ANALOG': {'A0': i % 1024},
+        'TempUnit': 'C'})
+
+
+def traffic(dev, i):
+    """ (topic, payload) of the i-th synthetic message for dev """
+    dev_type = dev['type']
+    topic = dev['status_topic']
+    if dev_type == 'switch':
+        return topic, 'ON' if i % 2 else 'OFF'
+    if dev_type == 'dimmer':
+        return topic.rsplit('/', 1)[0] + '/RESULT', json.dumps({'POWER': 'ON', 'Dimmer': i % 100})
+    if dev_type == 'ifan':
+        return topic, json.dumps({'FanSpeed': i % 4})
+    if dev_type == 'sensor':
+        return topic, json.dumps({'motion': 'motion' if i % 2 else 'standby', 'temperature': 20 + i % 5,
+                                  'humidity': 40, 'ldr': i % 1000, 'state': 'ON', 'brightness': 255,
+                                  'color': {'r': 1, 'g': 2, 'b': 3}})
+    if dev_type == 'flag':
+        return topic, ('OK', 'NOK', 'LO', 'HI')[i % 4]
+    if dev_type in ('Temp', 'TempHumid', 'TempHumidPress', 'analog'):
+        return topic, tasmota_sensor(i)
+    if dev_type == 'distance':
+        return topic, json.dumps({'SR04': {'Distance': 10 + i % 50}})
+    if dev_type == 'shellyflood':
+        reading, value = (('temperature', str(20 + i % 5)), ('flood', 'false'), ('battery', '87'))[i % 3]
+        return topic.replace('+', reading).replace('#', reading), value
+    if dev_type == 's31':
+        return topic, json.dumps({'ENERGY': {'Current': 0.1, 'Power': 10 + i % 5, 'Voltage': 120,
+                                             'Factor': 0.9, 'Total': 12.5}})
+    if dev_type == 'raw':
+        return topic, str(i)
+    if dev_type == 'RGBW':
+        return topic, json.dumps({'state': 'ON', 'br': i % 255, 'c': {'r': 1, 'g': 2, 'b': 3, 'w': 4}, 'pgm': 1})
+    if dev_type == 'ratgdo':
+        reading, value = (('door', 'open'), ('light', 'on'), ('motion', 'clear'), ('lock', 'locked'),
+                          ('obstruction', 'clear'), ('availability', 'online'))[i % 6]
+        return f'{topic}/status/{reading}', value
+    return None
+
+
+def run_params(params, workdir=None):
+    """
+    params with the driver snapshot off and the files the plugin writes
+    (snapshot, metrics, device cache) in a fresh directory, so a run neither
+    litters the CWD nor starts from the state of the previous one.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='bench')
+    isolated = {'snapshot_interval': '0',
+                'snapshot_file': os.path.join(workdir, 'drivers.json'),
+                'metrics_file': os.path.join(workdir, 'metrics.prom'),
+                'device_cache': os.path.join(workdir, 'devices.cache')}
+    isolated.update(params)
+    return isolated
+
+
+def build_controller(params):
+    """ controller configured with custom params, messages processed inline """
+    poly = FakePolyglot()
+    controller = Controller(poly, 'mqctrl', 'mqctrl', 'MQTT')
+    controller.parameterHandler(run_params(params))
+    controller.mqttc = FakeMqttClient()
+    controller.pool = InlinePool(controller._process_message)
+    controller.status_batcher = StatusBatcher(poly.send, controller.status_interval,
+                                              controller.status_max_latency, controller.status_batch_max)
+    controller.status_batcher.start()
+    return poly, controller
+
+
+def messages_by_type(controller, count):
+    """ count messages per device type, spread over the devices of that type """
+    by_type = {}
+    for address, device in controller.devices.items():
+        if controller.poly.getNode(address) is not None:
+            by_type.setdefault(device.type, []).append(device.dev)
+    messages = {}
+    for dev_type, devices in sorted(by_type.items()):
+        batch = []
+        for i in range(count):
+            message = traffic(devices[i % len(devices)], i)
+            if message is not None:
+                batch.append(FakeMessage(*message))
+        if batch:
+            messages[dev_type] = batch
+    return messages
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_type(controller, batch):
+    on_message = controller._on_message
+    latencies = []
+    started = time.perf_counter()
+    for message in batch:
+        t0 = time.perf_counter()
+        on_message(None, None, message)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    # memory is traced in a second pass so tracing does not skew the timings;
+    # the peak is reset per message, so it is what handling that one message allocated
+    gc.collect()
+    tracemalloc.start()
+    allocated = 0
+    peak = 0
+    for message in batch:
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        on_message(None, None, message)
+        message_peak = tracemalloc.get_traced_memory()[1]
+        allocated += message_peak - held
+        peak = max(peak, message_peak)
+    tracemalloc.stop()
+    return {
+        'messages': len(batch),
+        'rate': len(batch) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50) * 1e6,
+        'p99': percentile(latencies, 0.99) * 1e6,
+        'message_peak': allocated / len(batch),
+        'peak': peak / 1024,
+    }
+
+
+def run_pool(controller, messages, workers):
+    """ all traffic, interleaved, through a real WorkerPool """
+    mixed = [m for batch in messages.values() for m in batch]
+    processed = [0]
+    lock = threading.Lock()
+
+    def handler(item):
+        controller._process_message(item)
+        with lock:
+            processed[0] += 1
+
+    # large enough that no shard overflows however the devices hash
+    controller.pool = WorkerPool(handler, workers, queue_size=len(mixed) * workers)
+    controller.pool.start()
+    started = time.perf_counter()
+    for message in mixed:
+        controller._on_message(None, None, message)
+    deadline = started + 60
+    while processed[0] + controller.pool.dropped < len(mixed) and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    controller.pool.stop()
+    return processed[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='message path benchmark')
+    parser.add_argument('--devices', default=os.path.join(ROOT, 'devtest_large'),
+                        help='JSON device list (default: devtest_large)')
+    parser.add_argument('--boards', type=int, default=4, help='synthetic multi-sensor Tasmota boards to add')
+    parser.add_argument('--messages', type=int, default=2000, help='messages per device type')
+    parser.add_argument('--workers', type=int, default=2, help='worker threads for the pool pass')
+    parser.add_argument('--log-level', default='WARNING', help='plugin log level during the run')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    LOGGER.setLevel(getattr(logging, args.log_level.upper()))
+    devices = load_devices(args.devices, args.boards)
+    poly, controller = build_controller({'devlist': json.dumps(devices)})
+    messages = messages_by_type(controller, args.messages)
+
+    lines = [f'devices: {os.path.basename(args.devices)} + {args.boards} boards, '
+             f'{len(poly.nodes) - 1} nodes, {args.messages} messages per type',
+             f'{"type":<16}{"msgs/s":>10}{"p50 us":>10}{"p99 us":>10}{"peak B/msg":>12}{"peak KiB":>10}']
+    for dev_type, batch in messages.items():
+        result = run_type(controller, batch)
+        lines.append(f'{dev_type:<16}{result["rate"]:>10.0f}{result["p50"]:>10.1f}{result["p99"]:>10.1f}'
+                     f'{result["message_peak"]:>12.0f}{result["peak"]:>10.1f}')
+    count, elapsed = run_pool(controller, messages, args.workers)
+    controller.status_batcher.stop()
+    lines.append(f'mixed traffic through {args.workers} workers: {count} messages in {elapsed:.2f}s, '
+                 f'{count / elapsed:.0f} msgs/s')
+    lines.append(f'uplink: {poly.driver_updates} driver updates sent in {poly.sent} Polyglot messages, '
+                 f'{controller.mqttc.published} MQTT publishes')
+
+    report = '\n'.join(lines) + '\n'
+    OUT.write(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+broker
+
+Minimal in-process MQTT 3.1.1 broker for the bench tools, so they run
+without a mosquitto install.  Supports QoS 0 and 1, retained messages,
++ / # subscriptions, keep-alive pings and persistent sessions (QoS 1
+messages are queued while the client is away, without expiry or redelivery
+of unacknowledged ones); no will messages, no authentication.
+
+    python bench/broker.py [--port 1884]
+"""
+
+import argparse
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _string(data, offset):
+    length = struct.unpack_from('!H', data, offset)[0]
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+
+class Session(object):
+
+    def __init__(self, broker, sock, client_id, clean=True):
+        self.broker = broker
+        self.sock = sock
+        self.client_id = client_id
+        self.clean = clean
+        self.queued = []     # QoS 1 messages for a persistent session while offline
+        self.filters = {}    # level -> [granted qos or None, children]
+        self.packet_id = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic_filter, qos):
+        node = [None, self.filters]
+        for level in topic_filter.split('/'):
+            node = node[1].setdefault(level, [None, {}])
+        node[0] = qos
+
+    def unsubscribe(self, topic_filter):
+        node = [None, self.filters]
+        for level in topic_filter.split('/'):
+            node = node[1].get(level)
+            if node is None:
+                return
+        node[0] = None
+
+    def granted(self, topic):
+        """ highest qos of the filters matching topic, None if none match """
+        return self._granted(self.filters, topic.split('/'), 0)
+
+    def _granted(self, children, levels, i):
+        best = None
+        wildcard = children.get('#')
+        if wildcard is not None and wildcard[0] is not None:
+            best = wildcard[0]
+        if i == len(levels):
+            return best
+        for key in (levels[i], '+'):
+            node = children.get(key)
+            if node is None:
+                continue
+            qos = node[0] if i + 1 == len(levels) else None
+            if i + 1 == len(levels) and '#' in node[1] and node[1]['#'][0] is not None:
+                qos = max(qos or 0, node[1]['#'][0])  # 'a/#' also matches 'a'
+            deeper = self._granted(node[1], levels, i + 1) if i + 1 < len(levels) else None
+            for candidate in (qos, deeper):
+                if candidate is not None and (best is None or candidate > best):
+                    best = candidate
+        return best
+
+    def send(self, packet):
+        with self._lock:
+            try:
+                self.sock.sendall(packet)
+            except OSError:
+                pass
+
+    def publish(self, topic, payload, qos, retain=False):
+        header = PUBLISH << 4 | qos << 1 | (1 if retain else 0)
+        topic = topic.encode('utf-8')
+        body = struct.pack('!H', len(topic)) + topic
+        if qos:
+            with self._lock:
+                self.packet_id = self.packet_id % 65535 + 1
+                body += struct.pack('!H', self.packet_id)
+        body += payload
+        self.send(bytes([header]) + _encode_length(len(body)) + body)
+
+
+class Broker(object):
+
+    def __init__(self, host='127.0.0.1', port=0):
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker._serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+        self.sessions = {}
+        self.offline = {}    # client id -> persistent Session without a connection
+        self.retained = {}
+        self.received = 0
+        self.delivered = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            self.drop(session)
+
+    def drop(self, session):
+        """ close a client connection, as if the network failed """
+        try:
+            session.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def route(self, topic, payload, qos, retain):
+        with self._lock:
+            self.received += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = (payload, qos)
+                else:
+                    self.retained.pop(topic, None)
+            sessions = list(self.sessions.values())
+            if qos:
+                for session in self.offline.values():
+                    granted = session.granted(topic)
+                    if granted:
+                        session.queued.append((topic, payload))
+        for session in sessions:
+            granted = session.granted(topic)
+            if granted is not None:
+                session.publish(topic, payload, min(qos, granted))
+                self.delivered += 1
+
+    def _serve(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream = sock.makefile('rb')
+        session = None
+        try:
+            while True:
+                first = stream.read(1)
+                if not first:
+                    break
+                length, shift = 0, 0
+                while True:
+                    byte = stream.read(1)[0]
+                    length += (byte & 0x7f) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                data = stream.read(length)
+                kind, flags = first[0] >> 4, first[0] & 0x0f
+                if kind == CONNECT:
+                    session = self._connect(sock, data)
+                elif session is None:
+                    break
+                elif kind == PUBLISH:
+                    self._publish(session, flags, data)
+                elif kind == SUBSCRIBE:
+                    self._subscribe(session, data)
+                elif kind == UNSUBSCRIBE:
+                    packet_id = data[:2]
+                    offset = 2
+                    while offset < len(data):
+                        topic_filter, offset = _string(data, offset)
+                        session.unsubscribe(topic_filter.decode('utf-8'))
+                    session.send(bytes([UNSUBACK << 4, 2]) + packet_id)
+                elif kind == PINGREQ:
+                    session.send(bytes([PINGRESP << 4, 0]))
+                elif kind == DISCONNECT:
+                    break
+        except (OSError, IndexError, struct.error):
+            pass
+        finally:
+            if session is not None:
+                with self._lock:
+                    if self.sessions.get(session.client_id) is session:
+                        del self.sessions[session.client_id]
+                        if not session.clean:
+                            self.offline[session.client_id] = session
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _connect(self, sock, data):
+        _, offset = _string(data, 0)             # protocol name
+        clean = bool(data[offset + 1] & 0x02)
+        offset += 4                              # level, flags, keep-alive
+        client_id, offset = _string(data, offset)
+        client_id = client_id.decode('utf-8') or f'auto-{time.monotonic_ns()}'
+        with self._lock:
+            previous = self.sessions.get(client_id)
+            stored = self.offline.pop(client_id, None)
+            if previous is not None and not previous.clean:
+                stored = previous
+            if clean or stored is None:
+                session = Session(self, sock, client_id, clean)
+                present = 0
+            else:
+                # resume: same subscriptions, then the messages queued meanwhile
+                session = Session(self, sock, client_id, clean)
+                session.filters = stored.filters
+                session.queued = stored.queued
+                present = 1
+            self.sessions[client_id] = session
+        if previous is not None:
+            self.drop(previous)                  # a client id can only be connected once
+        session.send(bytes([CONNACK << 4, 2, present, 0]))
+        with self._lock:
+            queued, session.queued = session.queued, []
+        for topic, payload in queued:
+            session.publish(topic, payload, 1)
+        return session
+
+    def _publish(self, session, flags, data):
+        qos = (flags >> 1) & 0x03
+        topic, offset = _string(data, 0)
+        if qos:
+            packet_id = data[offset:offset + 2]
+            offset += 2
+            session.send(bytes([PUBACK << 4, 2]) + packet_id)
+        self.route(topic.decode('utf-8'), bytes(data[offset:]), min(qos, 1), bool(flags & 0x01))
+
+    def _subscribe(self, session, data):
+        packet_id = data[:2]
+        offset = 2
+        granted = []
+        filters = []
+        while offset < len(data):
+            topic_filter, offset = _string(data, offset)
+            qos = min(data[offset], 1)
+            offset += 1
+            topic_filter = topic_filter.decode('utf-8')
+            session.subscribe(topic_filter, qos)
+            granted.append(qos)
+            filters.append((topic_filter, qos))
+        session.send(bytes([SUBACK << 4]) + _encode_length(2 + len(granted)) + packet_id + bytes(granted))
+        matches = []
+        with self._lock:
+            wildcards = [(f, q) for f, q in filters if '+' in f or '#' in f]
+            for topic_filter, granted_qos in filters:
+                if (topic_filter, granted_qos) not in wildcards and topic_filter in self.retained:
+                    matches.append((topic_filter, self.retained[topic_filter], granted_qos))
+            if wildcards:
+                for topic, message in self.retained.items():
+                    for topic_filter, granted_qos in wildcards:
+                        if topic_matches(topic_filter, topic):
+                            matches.append((topic, message, granted_qos))
+                            break
+        for topic, (payload, qos), granted_qos in matches:
+            session.publish(topic, payload, min(qos, granted_qos), retain=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='minimal MQTT broker for testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1884)
+    args = parser.parse_args()
+    broker = Broker(args.host, args.port).start()
+    print(f'broker listening on {broker.host}:{broker.port}')
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+fakes
+
+Stand-ins for the udi_interface Interface and paho objects, just enough
+for the Controller and its nodes to run in-process without Polyglot or a
+broker.
+"""
+
+import threading
+
+
+class FakePolyglot(object):
+    """ the parts of udi_interface.Interface used by the controller and nodes """
+    START = 'start'
+    LOGLEVEL = 'loglevel'
+    CUSTOMPARAMS = 'customparams'
+    CUSTOMTYPEDPARAMS = 'customtypedparams'
+    CUSTOMTYPEDDATA = 'customtypeddata'
+    POLL = 'poll'
+    STOP = 'stop'
+    DISCOVER = 'discover'
+    ADDNODEDONE = 'addnodedone'
+
+    def __init__(self):
+        self.handlers = {}
+        self.nodes = {}
+        self.sent = 0
+        self.driver_updates = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, event, callback, address=None):
+        self.handlers.setdefault(event, []).append(callback)
+
+    def publish(self, event, *args):
+        for callback in self.handlers.get(event, []):
+            callback(*args)
+
+    def ready(self):
+        pass
+
+    def addNode(self, node, conn_status=None, rename=False):
+        self.nodes[node.address] = node
+        self.publish(self.ADDNODEDONE, {'address': node.address})
+        return node
+
+    def getNode(self, address):
+        return self.nodes.get(address)
+
+    def getNodes(self):
+        return self.nodes
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+
+    def send(self, message, type):
+        with self._lock:
+            self.sent += 1
+            if type == 'status':
+                self.driver_updates += len(message.get('set', []))
+
+    def db_getNodeDrivers(self, address=None, init=False):
+        return []
+
+    def updateProfile(self):
+        pass
+
+    def setCustomParamsDoc(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class FakeMessage(object):
+    """ paho MQTTMessage """
+    __slots__ = ('topic', 'payload', 'qos', 'retain')
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload.encode('utf-8') if isinstance(payload, str) else payload
+        self.qos = qos
+        self.retain = retain
+
+
+class FakePublishResult(object):
+    rc = 0
+
+
+class FakeMqttClient(object):
+    """ paho Client, publishes are only counted """
+
+    def __init__(self):
+        self.published = 0
+        self.mid = 0
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+        return FakePublishResult()
+
+    def subscribe(self, topics, qos=0):
+        self.mid += 1
+        return 0, self.mid
+
+    def unsubscribe(self, topics):
+        self.mid += 1
+        return 0, self.mid
+
+
+class InlinePool(object):
+    """ WorkerPool replacement running the handler on the caller's thread """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.dropped = 0
+
+    def submit(self, key, item):
+        self.handler(item)
+        return True
+
+    def depth(self):
+        return 0
+
+    def stop(self, timeout=0):
+        pass
@@ -0,0 +1,446 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+fleet
+
+End-to-end fleet simulator.  N simulated devices (Tasmota switches,
+dimmers and DS18B20 / AM2301 sensor boards, Shelly Flood sensors and
+ratgdo garage door openers) publish telemetry to a broker and answer
+POWER, Dimmer, State, Status 10 and ratgdo commands the way the firmware
+does.  A real Controller, against a fake Polyglot, runs on a devfile
+generated for the fleet and connects to the same broker.
+
+For every fleet size it reports startup time (start until all
+subscriptions are acknowledged), ingest at the configured telemetry rate,
+switch command round-trip latency (cmd_on / cmd_off until the ST driver
+follows the device's reply) and the ingest capacity when every device
+publishes as fast as it can.
+
+    python bench/fleet.py [--sizes 10,100,1000,5000] [--interval 10] [--duration 20]
+    python bench/fleet.py --write-devfile fleet.yaml --sizes 100
+
+Without --host an in-process broker (broker.py) is started; pass the
+address of a mosquitto to test against a real one.  All simulated
+devices share one MQTT connection.
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import yaml
+
+from bench import percentile, run_params, OUT, LOGGER
+from broker import Broker
+from fakes import FakePolyglot
+from nodes import Controller
+from replay import histogram_percentile
+
+# fleet mix, one entry per device in a cycle of ten
+MIX = ('switch', 'switch', 'switch', 'switch', 'dimmer', 'board', 'board', 'shellyflood', 'shellyflood', 'ratgdo')
+
+
+class SimDevice(object):
+    """ one simulated device, its devfile entries, telemetry and command replies """
+
+    def __init__(self, index, kind):
+        self.index = index
+        self.kind = kind
+        self.topic = f'fleet{index}'
+        self.power = 'OFF'
+        self.dimmer = 0
+        self.light = 'off'
+        self.door = 'closed'
+        self.lock = 'unlocked'
+        self.motion = 'clear'
+        self.temperature = 20.0 + random.random() * 5
+        self.humidity = 40.0 + random.random() * 20
+        self.count = 0
+
+    def devices(self):
+        """ devfile entries """
+        address = f'f{self.index}'
+        if self.kind == 'switch':
+            return [{'id': address, 'type': 'switch', 'status_topic': f'stat/{self.topic}/POWER',
+                     'cmd_topic': f'cmnd/{self.topic}/POWER'}]
+        if self.kind == 'dimmer':
+            return [{'id': address, 'type': 'dimmer', 'status_topic': f'stat/{self.topic}/DIMMER',
+                     'cmd_topic': f'cmnd/{self.topic}/dimmer'}]
+        if self.kind == 'board':
+            common = {'status_topic': f'tele/{self.topic}/SENSOR', 'cmd_topic': f'cmnd/{self.topic}/POWER'}
+            return [dict(common, id=f'{address}ds', type='Temp', sensor_id='DS18B20-1'),
+                    dict(common, id=f'{address}am', type='TempHumid', sensor_id='AM2301')]
+        if self.kind == 'shellyflood':
+            return [{'id': address, 'type': 'shellyflood',
+                     'status_topic': f'shellies/shellyflood-{self.index}/sensor/+',
+                     'cmd_topic': f'shellies/shellyflood-{self.index}/command'}]
+        return [{'id': address, 'type': 'ratgdo', 'status_topic': f'ratgdo/{self.topic}',
+                 'cmd_topic': f'ratgdo/{self.topic}'}]
+
+    def _time(self):
+        return time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def _sensors(self):
+        self.temperature += random.uniform(-0.2, 0.2)
+        self.humidity = min(100.0, max(0.0, self.humidity + random.uniform(-1, 1)))
+        return {'Time': self._time(),
+                'DS18B20-1': {'Id': f'{self.index:012X}', 'Temperature': round(self.temperature, 1)},
+                'AM2301': {'Temperature': round(self.temperature - 0.5, 1), 'Humidity': round(self.humidity, 1),
+                           'DewPoint': round(self.temperature - 12, 1)},
+                'TempUnit': 'C'}
+
+    def _state(self):
+        state = {'Time': self._time(), 'Uptime': '0T01:00:00', 'POWER': self.power}
+        if self.kind == 'dimmer':
+            state['Dimmer'] = self.dimmer
+        return state
+
+    def telemetry(self):
+        """ [(topic, payload)] of one telemetry period """
+        self.count += 1
+        if self.kind in ('switch', 'dimmer'):
+            return [(f'tele/{self.topic}/STATE', json.dumps(self._state()))]
+        if self.kind == 'board':
+            return [(f'tele/{self.topic}/SENSOR', json.dumps(self._sensors()))]
+        if self.kind == 'shellyflood':
+            base = f'shellies/shellyflood-{self.index}/sensor/'
+            return [(base + 'temperature', f'{self.temperature:.2f}'), (base + 'flood', 'false'),
+                    (base + 'battery', str(90 - self.count % 10))]
+        self.motion = 'detected' if self.motion == 'clear' else 'clear'
+        return [(f'ratgdo/{self.topic}/status/motion', self.motion),
+                (f'ratgdo/{self.topic}/status/availability', 'online')]
+
+    def announce(self, retain_state=False):
+        """ retained messages published when the device connects """
+        if self.kind in ('switch', 'dimmer') and retain_state:
+            # PowerRetain 1
+            return [(f'tele/{self.topic}/LWT', 'Online'), (f'stat/{self.topic}/POWER', self.power)]
+        if self.kind == 'ratgdo':
+            base = f'ratgdo/{self.topic}/status/'
+            return [(base + 'availability', 'online'), (base + 'door', self.door),
+                    (base + 'light', self.light), (base + 'lock', self.lock),
+                    (base + 'obstruction', 'clear')]
+        if self.kind == 'shellyflood':
+            return []
+        return [(f'tele/{self.topic}/LWT', 'Online')]
+
+    def tasmota(self, command, payload):
+        """ replies of a Tasmota device to cmnd/<topic>/<command> """
+        command = command.lower()
+        payload = payload.strip()
+        if command == 'power':
+            if payload.upper() in ('ON', '1'):
+                self.power = 'ON'
+            elif payload.upper() in ('OFF', '0'):
+                self.power = 'OFF'
+            elif payload.upper() in ('TOGGLE', '2'):
+                self.power = 'OFF' if self.power == 'ON' else 'ON'
+            return [(f'stat/{self.topic}/RESULT', json.dumps({'POWER': self.power})),
+                    (f'stat/{self.topic}/POWER', self.power)]
+        if command == 'dimmer' and self.kind == 'dimmer':
+            if payload:
+                try:
+                    self.dimmer = max(0, min(100, int(float(payload))))
+                except ValueError:
+                    return [(f'stat/{self.topic}/RESULT', json.dumps({'Command': 'Error'}))]
+                self.power = 'ON' if self.dimmer else 'OFF'
+            return [(f'stat/{self.topic}/RESULT', json.dumps({'POWER': self.power, 'Dimmer': self.dimmer}))]
+        if command == 'state':
+            return [(f'stat/{self.topic}/RESULT', json.dumps(self._state()))]
+        if command == 'status':
+            if payload == '10':
+                sensors = self._sensors() if self.kind == 'board' else {'Time': self._time()}
+                return [(f'stat/{self.topic}/STATUS10', json.dumps({'StatusSNS': sensors}))]
+            return [(f'stat/{self.topic}/STATUS', json.dumps({'Status': {'Topic': self.topic, 'Power': self.power}}))]
+        return [(f'stat/{self.topic}/RESULT', json.dumps({'Command': 'Unknown'}))]
+
+    def ratgdo(self, command, payload):
+        """ replies of a ratgdo to ratgdo/<topic>/command/<command> """
+        base = f'ratgdo/{self.topic}/status/'
+        payload = payload.strip().lower()
+        if command == 'light':
+            if payload == 'toggle':
+                payload = 'off' if self.light == 'on' else 'on'
+            if payload in ('on', 'off'):
+                self.light = payload
+            return [(base + 'light', self.light)]
+        if command == 'door':
+            if payload == 'open' and self.door != 'open':
+                self.door = 'open'
+                return [(base + 'door', 'opening'), (base + 'door', 'open')]
+            if payload == 'close' and self.door != 'closed':
+                self.door = 'closed'
+                return [(base + 'door', 'closing'), (base + 'door', 'closed')]
+            if payload == 'stop':
+                self.door = 'stopped'
+            return [(base + 'door', self.door)]
+        if command == 'lock':
+            if payload in ('lock', 'unlock'):
+                self.lock = payload + 'ed'
+            return [(base + 'lock', self.lock)]
+        return []
+
+
+class Fleet(object):
+    """ the simulated devices and the MQTT connection they share """
+
+    def __init__(self, size, interval, host, port, user, password, retain_state=False):
+        self.devices = [SimDevice(i, MIX[i % len(MIX)]) for i in range(size)]
+        self.by_topic = {dev.topic: dev for dev in self.devices}
+        self.interval = interval
+        self.retain_state = retain_state
+        self.published = 0
+        self.commands = 0
+        self._stop = threading.Event()
+        self._flood = threading.Event()
+        self._thread = None
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        self.client.username_pw_set(user, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.max_queued_messages_set(0)
+        self.client.connect(host, port, 30)
+        self.client.loop_start()
+        deadline = time.monotonic() + 10
+        while not self.client.is_connected():
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'fleet could not connect to {host}:{port}')
+            time.sleep(0.01)
+
+    def devfile(self, path):
+        with open(path, 'w') as f:
+            yaml.safe_dump({'devices': [entry for dev in self.devices for entry in dev.devices()]},
+                           f, sort_keys=False)
+
+    def _publish(self, messages, retain=False):
+        for topic, payload in messages:
+            self.client.publish(topic, payload, retain=retain or self._retained(topic))
+            self.published += 1
+
+    def _retained(self, topic):
+        """ state topics a device publishes retained: ratgdo always, Tasmota POWER with PowerRetain """
+        if topic.startswith('ratgdo/'):
+            return '/status/' in topic and not topic.endswith('/motion')
+        return self.retain_state and topic.endswith('/POWER')
+
+    def _on_connect(self, client, userdata, flags, rc):
+        # replies are several small packets, Nagle would hold all but the first
+        client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.subscribe([('cmnd/#', 0), ('ratgdo/+/command/+', 0)])
+        for dev in self.devices:
+            self._publish(dev.announce(self.retain_state), retain=True)
+
+    def _on_message(self, client, userdata, message):
+        levels = message.topic.split('/')
+        payload = message.payload.decode('utf-8', 'replace')
+        if levels[0] == 'cmnd' and len(levels) == 3:
+            dev = self.by_topic.get(levels[1])
+            replies = dev.tasmota(levels[2], payload) if dev is not None else []
+        elif levels[0] == 'ratgdo' and len(levels) == 4:
+            dev = self.by_topic.get(levels[1])
+            replies = dev.ratgdo(levels[3], payload) if dev is not None else []
+        else:
+            return
+        self.commands += 1
+        self._publish(replies)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fleet', daemon=True)
+        self._thread.start()
+
+    def flood(self, on):
+        """ publish telemetry back to back instead of once per interval """
+        if on:
+            self._flood.set()
+        else:
+            self._flood.clear()
+
+    def _run(self):
+        # every device on its own telemetry period, phases spread at random
+        now = time.monotonic()
+        due = [(now + random.random() * self.interval, dev.index) for dev in self.devices]
+        heapq.heapify(due)
+        while not self._stop.is_set():
+            if self._flood.is_set():
+                for dev in self.devices:
+                    self._publish(dev.telemetry())
+                    if not self._flood.is_set():
+                        break
+                continue
+            at, index = due[0]
+            delay = at - time.monotonic()
+            if delay > 0:
+                self._stop.wait(min(delay, 0.1))
+                continue
+            self._publish(self.devices[index].telemetry())
+            heapq.heapreplace(due, (max(at + self.interval, time.monotonic()), index))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def processed(controller):
+    """ messages taken off the queue, counted by the queue wait histogram """
+    return controller.metric_queue_wait.totals()[1]
+
+
+def wait_for(condition, timeout, step=0.01):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(step)
+    return True
+
+
+def round_trips(controller, count):
+    """ seconds from cmd_on / cmd_off until ST follows, for up to count switches """
+    switches = [node for node in controller.poly.getNodes().values() if node.id == 'MQSW'][:count]
+    latencies = []
+    for node in switches:
+        on = node.getDriver('ST') != 100
+        started = time.perf_counter()
+        if on:
+            node.cmd_on(None)
+        else:
+            node.cmd_off(None)
+        if wait_for(lambda: node.getDriver('ST') == (100 if on else 0), 5, 0.0005):
+            latencies.append(time.perf_counter() - started)
+    return sorted(latencies), len(switches)
+
+
+def run_size(size, args, host, port):
+    fleet = Fleet(size, args.interval, host, port, args.user, args.password, args.retain)
+    workdir = tempfile.mkdtemp(prefix='fleet')
+    devfile = os.path.join(workdir, 'fleet.yaml')
+    fleet.devfile(devfile)
+    params = run_params(dict(param.split('=', 1) for param in args.param), workdir)
+    params.update({'devfile': devfile, 'mqtt_server': host, 'mqtt_port': str(port),
+                   'mqtt_user': args.user, 'mqtt_password': args.password})
+    poly = FakePolyglot()
+    controller = Controller(poly, 'mqctrl', 'mqctrl', 'MQTT')
+    controller.parameterHandler(params)
+    nodes = len(poly.nodes) - 1
+
+    started = time.monotonic()
+    commands = fleet.commands
+    threading.Thread(target=controller.start, name='controller', daemon=True).start()
+    controller.startup.wait('subscribed', 120)
+    startup = time.monotonic() - started
+    # let the retained settle window and the post-connect query round finish before measuring
+    wait_for(lambda: controller.settle_started is None and controller.scheduler.progress() >= 100,
+             controller.retained_settle + controller.query_window + nodes / controller.query_rate + 30, 0.05)
+    ready = time.monotonic() - started
+    queries = fleet.commands - commands
+
+    fleet.start()
+    time.sleep(min(args.interval, 5))    # every device has started publishing
+    sent, done = fleet.published, processed(controller)
+    dropped = controller.metric_dropped.total()
+    time.sleep(args.duration)
+    offered = (fleet.published - sent) / args.duration
+    ingested = (processed(controller) - done) / args.duration
+    steady_dropped = controller.metric_dropped.total() - dropped
+
+    latencies, switches = round_trips(controller, args.commands)
+
+    fleet.flood(True)
+    time.sleep(1)
+    done = processed(controller)
+    dropped = controller.metric_dropped.total()
+    time.sleep(args.flood)
+    capacity = (processed(controller) - done) / args.flood
+    flood_dropped = controller.metric_dropped.total() - dropped
+    fleet.flood(False)
+
+    fleet.stop()
+    controller.stop()
+    wait = controller.metric_queue_wait
+    return {
+        'size': size, 'nodes': nodes, 'topics': len(controller.subscribed), 'startup': startup,
+        'ready': ready, 'queries': queries,
+        'offered': offered, 'ingested': ingested, 'dropped': steady_dropped,
+        'wait_p99': histogram_percentile(wait, 0.99) * 1000,
+        'rtt_p50': percentile(latencies, 0.5) * 1000 if latencies else float('nan'),
+        'rtt_p99': percentile(latencies, 0.99) * 1000 if latencies else float('nan'),
+        'rtt_lost': switches - len(latencies),
+        'capacity': capacity, 'flood_dropped': flood_dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulated device fleet, end to end')
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='comma separated fleet sizes')
+    parser.add_argument('--interval', type=float, default=10, help='telemetry period of every device, seconds')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of steady telemetry to measure')
+    parser.add_argument('--flood', type=float, default=5, help='seconds of back to back telemetry to measure')
+    parser.add_argument('--commands', type=int, default=50, help='switch round trips to time per size')
+    parser.add_argument('--retain', action='store_true',
+                        help='Tasmota devices publish POWER retained (PowerRetain 1), try with --param retained_settle=1')
+    parser.add_argument('--host', help='broker to use instead of the in-process one')
+    parser.add_argument('--port', type=int, default=1884)
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra custom parameter, e.g. workers=4')
+    parser.add_argument('--write-devfile', metavar='PATH', help='only write the devfile of the first size and exit')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.write_devfile:
+        devices = [SimDevice(i, MIX[i % len(MIX)]) for i in range(sizes[0])]
+        with open(args.write_devfile, 'w') as f:
+            yaml.safe_dump({'devices': [entry for dev in devices for entry in dev.devices()]}, f, sort_keys=False)
+        return
+
+    LOGGER.setLevel(getattr(logging, args.log_level.upper()))
+    broker = None
+    host, port = args.host, args.port
+    if host is None:
+        broker = Broker().start()
+        host, port = broker.host, broker.port
+
+    lines = [f'telemetry every {args.interval:g}s per device, {args.duration:g}s steady, {args.flood:g}s flood, '
+             f'broker {"in-process" if broker else f"{host}:{port}"}',
+             f'{"devices":>8}{"nodes":>7}{"topics":>8}{"start s":>9}{"ready s":>9}{"queries":>9}'
+             f'{"offer/s":>9}{"in/s":>9}{"drop":>6}'
+             f'{"wait99":>8}{"rtt50":>8}{"rtt99":>8}{"lost":>6}{"max/s":>9}{"fdrop":>7}']
+    OUT.write(lines[0] + '\n' + lines[1] + '\n')
+    for size in sizes:
+        r = run_size(size, args, host, port)
+        line = (f'{r["size"]:>8}{r["nodes"]:>7}{r["topics"]:>8}{r["startup"]:>9.2f}{r["ready"]:>9.2f}'
+                f'{r["queries"]:>9}{r["offered"]:>9.0f}'
+                f'{r["ingested"]:>9.0f}{r["dropped"]:>6.0f}{r["wait_p99"]:>8g}{r["rtt_p50"]:>8.1f}'
+                f'{r["rtt_p99"]:>8.1f}{r["rtt_lost"]:>6}{r["capacity"]:>9.0f}{r["flood_dropped"]:>7.0f}')
+        OUT.write(line + '\n')
+        lines.append(line)
+    lines.append('start s: until subscribed, ready s: until the start-up queries are sent, queries: commands '
+                 'answered by the fleet meanwhile,\noffer/s: fleet publishes, in/s: messages processed by the plugin, '
+                 'wait99: queue wait p99 ms, rtt: switch command round trip ms, max/s: processed while flooding')
+    OUT.write(lines[-1] + '\n')
+    if broker is not None:
+        broker.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+record
+
+Records the traffic of a live broker to a traffic file (see traffic.py),
+appending to it if it exists.
+
+    python bench/record.py house.mqtr --host eisy.local --port 1884 --user admin --password admin \\
+        [--topic '#'] [--duration 3600]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from traffic import TrafficWriter
+
+
+def main():
+    parser = argparse.ArgumentParser(description='record MQTT traffic')
+    parser.add_argument('file', help='traffic file to append to')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1884)
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--topic', action='append', help="topic filter, may be repeated (default: '#')")
+    parser.add_argument('--duration', type=float, default=0, help='seconds to record, 0 = until Ctrl-C')
+    args = parser.parse_args()
+
+    writer = TrafficWriter(args.file)
+    if writer.truncated:
+        print(f'{args.file}: removed {writer.truncated} bytes of a record cut short', file=sys.stderr)
+    lock = threading.Lock()
+    topics = args.topic or ['#']
+
+    def on_connect(client, userdata, flags, rc):
+        if rc != 0:
+            print(f'connect failed: {mqtt.connack_string(rc)}', file=sys.stderr)
+            return
+        client.subscribe([(topic, 0) for topic in topics])
+        print(f'recording {", ".join(topics)} to {args.file}')
+
+    def on_message(client, userdata, message):
+        with lock:
+            writer.write(time.time(), message.topic, message.payload, message.qos, message.retain)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    client.username_pw_set(args.user, args.password)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.host, args.port, 10)
+    client.loop_start()
+    started = time.monotonic()
+    try:
+        while not args.duration or time.monotonic() - started < args.duration:
+            time.sleep(1)
+            with lock:
+                writer.flush()
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    with lock:
+        writer.close()
+    print(f'{writer.count} messages recorded')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+replay
+
+Replays a traffic file (see record.py) through Controller._on_message
+and the WorkerPool, against a fake Polyglot configured with the same
+devfile / devlist as the house the traffic was recorded in.
+
+    python bench/replay.py house.mqtr --devfile devices.yaml [--speed 1]
+
+--speed 1 replays in real time, N replays N times faster and 0 as fast
+as possible.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from bench import build_controller, OUT, LOGGER
+from fakes import FakeMessage
+from nodes import WorkerPool
+from traffic import read_traffic
+
+
+def histogram_percentile(histogram, fraction):
+    """ upper bucket bound below which fraction of the observations fall """
+    counts = [0] * (len(histogram.buckets) + 1)
+    for entry in list(histogram.values.values()):
+        for i in range(len(histogram.buckets)):
+            counts[i] += entry[i]
+        counts[-1] += entry[-1]
+    total = counts[-1]
+    if total == 0:
+        return 0.0
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, counts):
+        cumulative += count
+        if cumulative >= fraction * total:
+            return bound
+    return float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay recorded MQTT traffic')
+    parser.add_argument('file', help='traffic file')
+    config = parser.add_mutually_exclusive_group(required=True)
+    config.add_argument('--devfile', help='YAML devfile of the recorded installation')
+    config.add_argument('--devlist', help='JSON devlist file of the recorded installation')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = real time, N = N times faster, 0 = max')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra custom parameter, e.g. workers=4')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    LOGGER.setLevel(getattr(logging, args.log_level.upper()))
+    params = dict(param.split('=', 1) for param in args.param)
+    if args.devfile:
+        params['devfile'] = args.devfile
+    else:
+        with open(args.devlist) as f:
+            params['devlist'] = json.dumps(json.load(f))
+    poly, controller = build_controller(params)
+    if not controller.devices:
+        print('no devices configured, check the devfile / devlist', file=sys.stderr)
+        sys.exit(1)
+    controller.pool = WorkerPool(controller._process_message, controller.workers, controller.queue_size)
+    controller.pool.start()
+
+    first = None
+    lag = 0.0
+    count = 0
+    started = time.perf_counter()
+    for record in read_traffic(args.file):
+        if first is None:
+            first = record.timestamp
+        if args.speed > 0:
+            due = started + (record.timestamp - first) / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+        controller._on_message(None, None, FakeMessage(record.topic, record.payload, record.qos, record.retain))
+        count += 1
+    sent = time.perf_counter() - started
+    while controller.pool.depth():
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    controller.pool.stop()
+    controller.status_batcher.stop()
+
+    wait = controller.metric_queue_wait
+    OUT.write(f'{count} messages replayed in {elapsed:.2f}s ({count / elapsed:.0f} msgs/s), '
+              f'sending took {sent:.2f}s, max lag behind schedule {lag * 1000:.0f} ms\n'
+              f'queue wait p50 <= {histogram_percentile(wait, 0.5) * 1000:g} ms, '
+              f'p99 <= {histogram_percentile(wait, 0.99) * 1000:g} ms\n'
+              f'dropped: {controller.pool.dropped}, unrouted: {controller.metric_unrouted.total()}, '
+              f'node errors: {controller.metric_update_errors.total()}\n'
+              f'uplink: {poly.driver_updates} driver updates sent in {poly.sent} Polyglot messages\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+traffic
+
+Append-only binary file of recorded MQTT messages.  The file starts with
+the 5 byte magic b'MQTR\\x01', followed by records of
+
+    float64 timestamp, uint16 topic length, uint32 payload length,
+    uint8 flags (bits 0-1 QoS, bit 2 retain), topic (utf-8), payload
+
+all little-endian.  A record cut short by a crash while writing is
+ignored when reading, and cut off before a writer appends to the file.
+"""
+
+import os
+import struct
+
+MAGIC = b'MQTR\x01'
+HEADER = struct.Struct('<dHIB')
+RETAIN = 0x04
+
+
+class TrafficRecord(object):
+    __slots__ = ('timestamp', 'topic', 'payload', 'qos', 'retain')
+
+    def __init__(self, timestamp, topic, payload, qos=0, retain=False):
+        self.timestamp = timestamp
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class TrafficWriter(object):
+
+    def __init__(self, path):
+        # bytes of a cut short last record removed before appending
+        self.truncated = 0
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+        else:
+            self.file = open(path, 'r+b')
+            try:
+                end = complete_length(self.file, path)
+            except ValueError:
+                self.file.close()
+                raise
+            self.truncated = os.fstat(self.file.fileno()).st_size - end
+            self.file.truncate(end)
+            self.file.seek(end)
+        self.count = 0
+
+    def write(self, timestamp, topic, payload, qos=0, retain=False):
+        topic = topic.encode('utf-8')
+        flags = (qos & 0x03) | (RETAIN if retain else 0)
+        self.file.write(HEADER.pack(timestamp, len(topic), len(payload), flags) + topic + payload)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def complete_length(f, path) -> int:
+    """ bytes of a traffic file up to the end of its last complete record """
+    size = os.fstat(f.fileno()).st_size
+    f.seek(0)
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{path} is not a traffic recording')
+    end = len(MAGIC)
+    while end + HEADER.size <= size:
+        f.seek(end)
+        _, topic_len, payload_len, _ = HEADER.unpack(f.read(HEADER.size))
+        if end + HEADER.size + topic_len + payload_len > size:
+            break
+        end += HEADER.size + topic_len + payload_len
+    return end
+
+
+def read_traffic(path):
+    """ yields the TrafficRecords of a file in recorded order """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a traffic recording')
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            timestamp, topic_len, payload_len, flags = HEADER.unpack(header)
+            body = f.read(topic_len + payload_len)
+            if len(body) < topic_len + payload_len:
+                return
+            yield TrafficRecord(timestamp, body[:topic_len].decode('utf-8'), body[topic_len:],
+                                flags & 0x03, bool(flags & RETAIN))
@@ -0,0 +1,35 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+AtomicFile
+
+Replace a file atomically: the content is written to a temporary file next
+to it, flushed to disk and renamed over it, so a reader (or a restart after
+a power cut) finds either the old file or the new one, never a partial one.
+"""
+
+import os
+
+
+def write_atomic(path, write, mode='w'):
+    """
+    :param path: file to replace
+    :param write: callable(f) writing the new content to the open file
+    :param mode: 'w' or 'wb'
+    Errors are raised to the caller, the temporary file is removed.
+    """
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
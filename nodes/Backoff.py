@@ -0,0 +1,39 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+Backoff
+
+Exponential backoff with jitter for reconnect attempts: every delay
+doubles up to maximum, and jitter takes a random fraction off each one so
+plugins restarted together do not retry in lock step.
+"""
+
+import random
+
+
+class Backoff(object):
+
+    def __init__(self, initial=1.0, maximum=60.0, jitter=0.5, factor=2.0):
+        """
+        :param initial: first delay, seconds
+        :param maximum: largest delay, seconds
+        :param jitter: most of a delay, as a fraction, taken off at random
+        :param factor: growth of the delay per attempt
+        """
+        self.initial = float(initial)
+        self.maximum = max(float(maximum), self.initial)
+        self.jitter = min(max(float(jitter), 0.0), 1.0)
+        self.factor = float(factor)
+        self.attempts = 0
+
+    def next(self) -> float:
+        """ delay before the next attempt """
+        delay = min(self.maximum, self.initial * self.factor ** min(self.attempts, 32))
+        self.attempts += 1
+        return delay * (1.0 - self.jitter * random.random())
+
+    def reset(self):
+        """ the last attempt succeeded """
+        self.attempts = 0
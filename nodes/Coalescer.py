@@ -0,0 +1,78 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+Coalescer
+
+Latest-value-wins stage for high-rate telemetry topics.  The first
+message on a topic is passed straight through; any further messages on
+that topic within the window replace each other and only the newest is
+delivered when the window closes.  Only used for node types that set
+coalesce = True, edge-triggered types never go through here.
+"""
+
+import udi_interface
+import threading
+import time
+
+LOGGER = udi_interface.LOGGER
+
+
+class Coalescer(object):
+
+    def __init__(self, dispatch, window=2.0, name='coalescer'):
+        """
+        :param dispatch: callable(key, item) receiving the messages to deliver
+        :param window: seconds during which messages on one topic are merged
+        """
+        self.dispatch = dispatch
+        self.window = float(window)
+        self.name = name
+        self.pending = {}    # topic -> (key, item)
+        self.last_sent = {}  # topic -> time of last delivery
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.window + 1)
+        self.flush()
+
+    def offer(self, topic, key, item):
+        now = time.monotonic()
+        with self._lock:
+            if topic not in self.pending and now - self.last_sent.get(topic, 0.0) >= self.window:
+                self.last_sent[topic] = now
+                deliver = True
+            else:
+                if topic in self.pending:
+                    self.coalesced += 1
+                self.pending[topic] = (key, item)
+                deliver = False
+        if deliver:
+            self.dispatch(key, item)
+
+    def flush(self):
+        with self._lock:
+            pending = self.pending
+            self.pending = {}
+            now = time.monotonic()
+            for topic in pending:
+                self.last_sent[topic] = now
+        for key, item in pending.values():
+            self.dispatch(key, item)
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            try:
+                self.flush()
+            except Exception as ex:
+                LOGGER.error(f'{self.name}: flush failed: {ex}')
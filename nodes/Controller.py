@@ -8,11 +8,29 @@ controller mqctrl
 
 import udi_interface
 
-from typing import Dict, List
+import logging
+from typing import Dict, List, Tuple
 import paho.mqtt.client as mqtt
 import json
-import yaml
 import time
+import threading
+import copy
+import socket
+from collections import deque
+
+from nodes import Envelope
+from nodes import WorkerPool
+from nodes import Coalescer
+from nodes import TopicTrie
+from nodes import QueryScheduler
+from nodes import StatusBatcher
+from nodes import TokenBucket
+from nodes import LogLimiter
+from nodes import Metrics
+from nodes import StartupPhases
+from nodes import Backoff
+from nodes import DriverSnapshot
+from nodes import DeviceTable
 
 # Nodes
 from nodes import MQSwitch
@@ -47,6 +65,26 @@ ISY = udi_interface.ISY
 
 class Controller(udi_interface.Node):
     id = 'mqctrl'
+    # node class per device type, the supported types; each class derives its status topics
+    NODE_TYPES = {
+        'switch': MQSwitch,
+        'trigger': MQTrigger,
+        'dimmer': MQDimmer,
+        'ifan': MQFan,
+        'sensor': MQSensor,
+        'dsensor': MQDroplet,
+        'flag': MQFlag,
+        'TempHumid': MQdht,
+        'Temp': MQds,
+        'TempHumidPress': MQbme,
+        'distance': MQhcsr,
+        'shellyflood': MQShellyFlood,
+        'analog': MQAnalog,
+        's31': MQs31,
+        'raw': MQraw,
+        'RGBW': MQRGBWstrip,
+        'ratgdo': MQratgdo,
+    }
 
     def __init__(self, polyglot, primary, address, name):
         """
@@ -64,23 +102,122 @@ class Controller(udi_interface.Node):
         self.primary = primary # defined as self.address by main
         self.address = address
         self.name = name
-        self.n_queue = []
+        self.node_done: Dict[str, threading.Event] = {}
+        self.node_done_at: Dict[str, float] = {}
+        self.node_lock = threading.Lock()
+        self.add_stats = {}
 
         # here are specific variables to this controller
         self.discovery = False
+        self.discovery_lock = threading.Lock()
+        # messages received while discovery runs are held and replayed afterwards
+        self.discovery_buffer = 1000
+        self.pending_messages = deque()
+        self.pending_lock = threading.Lock()
+        self.buffered = 0
+        self.replayed = 0
+        self.overflowed = 0
         self.mqtt_server = "localhost"
         self.mqtt_port = 1884
         self.mqtt_user = 'admin'
         self.mqtt_password = 'admin'
         self.webhook_url = "https://www.virtualsmarthome.xyz/url_routine_trigger/activate.php"
-        self.devlist = {}
+        # devfile / devlist compiled by checkParams, cached in device_cache
         # e.g. [{'id': 'topic1', 'type': 'switch', 'status_topic': 'stat/topic1/power',
         # 'cmd_topic': 'cmnd/topic1/power'}]
-        self.status_topics = []
-        # Maps to device IDs
-        self.status_topics_to_devices: Dict[str, str] = {}
-        self.valid_configuration = False
-        self.parmDone = False
+        self.device_table = DeviceTable({})
+        self.device_cache = 'devices.cache'
+        # compiled devices of the last discovery, keyed by address
+        self.devices = self.device_table.devices
+        # Maps status topics to the device addresses subscribed to them
+        self.status_topics: Dict[str, List[str]] = {}
+        # Maps status topic filters (wildcards allowed) to device IDs
+        self.status_topics_to_devices = TopicTrie()
+        # Reverse index, device address to its status topics
+        self.device_topics: Dict[str, List[str]] = {}
+        # Maps (device base topic, sensor_id) to multi-sensor nodes
+        self.sensor_routes: Dict[Tuple[str, str], udi_interface.Node] = {}
+        self.sensor_route_keys: Dict[str, Tuple[str, str]] = {}
+        # topics the broker has been asked to send us, with their QoS
+        self.subscribed: Dict[str, int] = {}
+        # subscription QoS per device address, node type default or device "qos"
+        self.device_qos: Dict[str, int] = {}
+        self.subscribe_chunk = 50
+        # topics of each SUBSCRIBE still waiting for its SUBACK, by MID
+        self.sub_pending: Dict[int, List[str]] = {}
+        self.sub_started = None
+        self.subscribe_latency = 0.0
+        self.sub_lock = threading.Lock()
+        # startup is driven by these phases instead of polling flags, see start()
+        self.startup = StartupPhases(('params', 'nodes', 'connected', 'subscribed'))
+        self.startup_lock = threading.Lock()
+        # subscriptions were sent on the current connection
+        self.session_ready = False
+        self.mqttc = None
+        # the supervisor thread owns connecting and reconnecting, with backoff
+        self.supervisor = None
+        self.stopping = threading.Event()
+        self.connection_lost = threading.Event()
+        self.backoff = Backoff()
+        # a stable client id with a persistent session keeps subscriptions and
+        # queued QoS 1 messages on the broker across reconnects
+        self.client_id = ''
+        self.persistent_session = False
+        self.session_present = False
+        self.outage_started = None
+        self.first_message_pending = False
+        # message processing happens on a worker pool, not paho's network thread
+        self.workers = 2
+        self.queue_size = 1000
+        self.pool = None
+        # node creation during discovery
+        self.add_node_window = 8
+        self.add_node_timeout = 10.0
+        self.add_node_retries = 2
+        # latest-value-wins window for telemetry node types, 0 = disabled
+        self.coalesce_window = 0.0
+        self.coalescer = None
+        # post-connect queries are spread over query_window seconds
+        self.query_window = 10.0
+        self.query_rate = 20.0
+        self.query_jitter = 0.5
+        self.scheduler = None
+        # retained warm start: seconds to collect retained state after subscribing, 0 = query every node
+        self.retained_settle = 0.0
+        self.settle_started = None
+        self.settle_timer = None
+        # the window starts anyway when SUBACKs are still missing after this many seconds
+        self.suback_timeout = 10.0
+        self.settle_fallback = False
+        # one Tasmota 'Status 10' request per device per window, shared by its sensors
+        self.status_query_window = 5.0
+        self.status_queried: Dict[str, float] = {}
+        self.status_queries_skipped = 0
+        self.status_query_lock = threading.Lock()
+        # driver updates of all nodes are sent to Polyglot in bulk, 0 = disabled
+        self.status_interval = 0.1
+        self.status_max_latency = 1.0
+        self.status_batch_max = 200
+        self.status_batcher = None
+        # driver reports per second allowed per node, 0 = unlimited
+        self.report_rate = 0.0
+        self.report_burst = 10
+        # sampled payload logging and rate-limited repeated errors on the message path
+        self.log_limiter = LogLimiter()
+        # metrics registry, summarised on GV6-GV8 and written to metrics_file
+        self.metrics = Metrics()
+        self.metrics_file = 'metrics.prom'
+        self.metrics_interval = 60.0
+        self.metrics_written = 0.0
+        self.metrics_polled = (time.monotonic(), 0, 0.0, 0)
+        self._init_metrics()
+        # last known driver values, restored by the first discovery, 0 = disabled
+        self.snapshot_file = 'drivers.json'
+        self.snapshot_interval = 300.0
+        self.snapshot_max_age = 900.0
+        self.snapshot_saved = time.monotonic()
+        self.snapshot_state = None
+        self.first_query_round = True
 
         # Create data storage classes to hold specific data that we need
         # to interact with.  
@@ -108,23 +245,77 @@ class Controller(udi_interface.Node):
         self.poly.addNode(self)
 
         '''
-        node_queue() and wait_for_node_event() create a simple way to wait
-        for a node to be created.  The nodeAdd() API call is asynchronous and
-        will return before the node is fully created. Using this, we can wait
-        until it is fully created before we try to use it.
+        node_queue() and _wait_node_added() track node creation.  The nodeAdd()
+        API call is asynchronous and will return before the node is fully
+        created.  Each add gets an event keyed by address which is set by the
+        ADDNODEDONE event, so discovery can keep a window of adds in flight
+        and only waits (with a timeout and retries) when the window is full.
         '''
-    def node_queue(self, data):
-        self.n_queue.append(data['address'])
+    def _init_metrics(self):
+        metrics = self.metrics
+        self.metric_received = metrics.counter('messages_received_total', 'MQTT messages received')
+        self.metric_unrouted = metrics.counter('messages_unrouted_total', 'messages on a topic no node subscribed to')
+        self.metric_dropped = metrics.counter('messages_dropped_total', 'messages dropped because the queue was full')
+        self.metric_queue_wait = metrics.histogram('message_wait_seconds', 'time from receipt to processing')
+        self.metric_update = metrics.histogram('update_info_seconds', 'updateInfo duration per node type')
+        self.metric_update_errors = metrics.counter('update_info_errors_total', 'messages a node failed to process')
+        self.metric_published = metrics.counter('messages_published_total', 'MQTT messages published')
+        self.metric_publish_errors = metrics.counter('publish_errors_total', 'MQTT publishes that failed')
+        self.metric_discovery = metrics.gauge('discovery_seconds', 'duration of the last discovery')
+        self.metric_disconnects = metrics.counter('disconnects_total', 'broker connections lost')
+        self.metric_reconnect = metrics.gauge('reconnect_seconds', 'connection lost until reconnected, last outage')
+        self.metric_first_message = metrics.gauge('first_message_seconds',
+                                                  'connection lost until the next message, last outage')
+        metrics.gauge('queue_depth', 'messages waiting for a worker',
+                      lambda: self.pool.depth() if self.pool is not None else 0)
+        metrics.gauge('devices', 'configured devices', lambda: len(self.devices))
+        metrics.gauge('subscribed_topics', 'topic filters subscribed', lambda: len(self.subscribed))
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.3)
-        self.n_queue.pop()
+    def node_queue(self, data):
+        self.node_done_at[data['address']] = time.monotonic()
+        self._node_event(data['address']).set()
+
+    def _node_event(self, address):
+        with self.node_lock:
+            event = self.node_done.get(address)
+            if event is None:
+                event = self.node_done[address] = threading.Event()
+            return event
+
+    def _add_node(self, node, inflight):
+        while len(inflight) >= self.add_node_window:
+            self._wait_node_added(*inflight.popleft())
+        self._node_event(node.address).clear()
+        self.poly.addNode(node)
+        inflight.append((node, time.monotonic()))
+
+    def _wait_node_added(self, node, added_at):
+        event = self._node_event(node.address)
+        for attempt in range(self.add_node_retries + 1):
+            if event.wait(self.add_node_timeout):
+                elapsed = max(0.0, self.node_done_at.get(node.address, added_at) - added_at)
+                self.add_stats['added'] += 1
+                self.add_stats['total'] += elapsed
+                self.add_stats['max'] = max(self.add_stats['max'], elapsed)
+                return True
+            if attempt < self.add_node_retries:
+                LOGGER.warning(f"addNode {node.address} not confirmed after {self.add_node_timeout}s, retrying")
+                self.add_stats['retries'] += 1
+                self.poly.addNode(node)
+        LOGGER.error(f"addNode {node.address} was never confirmed, continuing discovery")
+        self.add_stats['failed'] += 1
+        return False
+
+    def _log_add_stats(self, elapsed):
+        stats = self.add_stats
+        average = stats['total'] / stats['added'] if stats['added'] else 0.0
+        LOGGER.info(f"discovery timing: {elapsed:.2f}s, nodes added: {stats['added']}, "
+                    f"avg add: {average:.2f}s, max add: {stats['max']:.2f}s, "
+                    f"retries: {stats['retries']}, failed: {stats['failed']}")
 
     def start(self):
         self.Notices['hello'] = 'Start-up'
 
-        self.last = 0.0
         # Send the profile files to the ISY if necessary. The profile version
         # number will be checked and compared. If it has changed since the last
         # start, the new files will be sent.
@@ -139,35 +330,43 @@ class Controller(udi_interface.Node):
         # heartbeat in your node server
         self.heartbeat(True)
 
-        while self.valid_configuration is False:
+        # parameterHandler runs on its own thread and starts discovery as
+        # soon as the parameters are valid; the broker connection is made
+        # here meanwhile and subscriptions follow once both are done
+        while not self.startup.wait('params', 30):
             LOGGER.info('Start: Waiting on valid configuration')
             self.Notices['waiting'] = 'Waiting on valid configuration'
-            time.sleep(5)
 
-        # get user mqtt server connection going
-        self.mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        if self.status_interval > 0:
+            self.status_batcher = StatusBatcher(self.poly.send, self.status_interval,
+                                                self.status_max_latency, self.status_batch_max)
+            self.status_batcher.start()
+        # workers are started before connecting so no message finds the pool missing
+        self.pool = WorkerPool(self._process_message, self.workers, self.queue_size)
+        self.pool.start()
+        if self.coalesce_window > 0:
+            self.coalescer = Coalescer(self._dispatch, self.coalesce_window)
+            self.coalescer.start()
+        self.scheduler = QueryScheduler(self.query_window, self.query_rate, self.query_jitter,
+                                        self._report_query_progress)
+
+        # get user mqtt server connection going; reconnects are left to the supervisor
+        self.mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=self.client_id,
+                                 clean_session=not self.persistent_session, reconnect_on_failure=False)
         self.mqttc.on_connect = self._on_connect
         self.mqttc.on_disconnect = self._on_disconnect
         self.mqttc.on_message = self._on_message
+        self.mqttc.on_subscribe = self._on_subscribe
         self.mqttc.username_pw_set(self.mqtt_user, self.mqtt_password)
-        while not self.parmDone:
-            LOGGER.info("Start: Waiting on first Discovery Completion")
-            time.sleep(1)
-        try:
-            self.mqttc.connect(self.mqtt_server, self.mqtt_port, 10)
-            self.mqttc.loop_start()
-        except Exception as ex:
-            LOGGER.error("Error connecting to Poly MQTT broker {}".format(ex))
-            self.Notices['mqtt'] = 'Error on user MQTT connection'
+        # connects, and retries, while discovery runs
+        self.supervisor = threading.Thread(target=self._supervise, name='mqtt-supervisor', daemon=True)
+        self.supervisor.start()
 
-        connected = self.mqttc.is_connected()
-        while not connected:
+        while not self.startup.wait('connected', 30):
             LOGGER.error('Start: Waiting on user MQTT connection')
             self.Notices['mqtt'] = 'Waiting on user MQTT connection'
-            time.sleep(3)
-            connected = self.mqttc.is_connected()
         self.removeNoticesAll()
-        LOGGER.info("Start Done...")
+        LOGGER.info(f"Start Done... ({self.startup.summary()})")
 
     """
     Called via the CUSTOMPARAMS event. When the user enters or
@@ -188,8 +387,8 @@ class Controller(udi_interface.Node):
         self.Parameters.load(params)
         LOGGER.info('parmHandler: Loading parameters now')
         if self.checkParams():
+            self.startup.mark('params')
             self.discover_nodes()
-            self.parmDone = True
         LOGGER.info('parmHandler Done...')
 
     """
@@ -214,32 +413,64 @@ class Controller(udi_interface.Node):
         self.mqtt_user = self.Parameters["mqtt_user"] or 'admin'
         self.mqtt_password = self.Parameters["mqtt_password"] or 'admin'
         self.webhook_url = self.Parameters["webhook_url"] or "https://www.virtualsmarthome.xyz/url_routine_trigger/activate.php"
+        try:
+            self.workers = int(self.Parameters["workers"] or 2)
+            self.queue_size = int(self.Parameters["queue_size"] or 1000)
+            self.coalesce_window = float(self.Parameters["coalesce_window"] or 0)
+            self.discovery_buffer = max(0, int(self.Parameters["discovery_buffer"] or 1000))
+            self.add_node_window = max(1, int(self.Parameters["add_node_window"] or 8))
+            self.add_node_timeout = float(self.Parameters["add_node_timeout"] or 10)
+            self.add_node_retries = int(self.Parameters["add_node_retries"] or 2)
+            self.subscribe_chunk = max(1, int(self.Parameters["subscribe_chunk"] or 50))
+            self.query_window = float(self.Parameters["query_window"] or 10)
+            self.query_rate = float(self.Parameters["query_rate"] or 20)
+            self.query_jitter = float(self.Parameters["query_jitter"] or 0.5)
+            self.retained_settle = float(self.Parameters["retained_settle"] or 0)
+            self.status_query_window = float(self.Parameters["status_query_window"] or 5)
+            self.status_interval = float(self.Parameters["status_interval"] or 0.1)
+            self.status_max_latency = float(self.Parameters["status_max_latency"] or 1)
+            self.status_batch_max = max(1, int(self.Parameters["status_batch_max"] or 200))
+            self.report_rate = float(self.Parameters["report_rate"] or 0)
+            self.report_burst = max(1, int(self.Parameters["report_burst"] or 10))
+            self.log_limiter.sample_interval = float(self.Parameters["log_sample_interval"] or 60)
+            self.log_limiter.repeat_interval = float(self.Parameters["log_repeat_interval"] or 60)
+            self.metrics_interval = float(self.Parameters["metrics_interval"] or 60)
+            self.snapshot_interval = float(self.Parameters["snapshot_interval"] or 300)
+            self.snapshot_max_age = float(self.Parameters["snapshot_max_age"] or 900)
+            self.backoff = Backoff(float(self.Parameters["reconnect_min"] or 1),
+                                   float(self.Parameters["reconnect_max"] or 60),
+                                   float(self.Parameters["reconnect_jitter"] or 0.5))
+        except ValueError as ex:
+            LOGGER.error(f"checkParams: tuning parameters must be numbers: {ex}")
+            return False
+        self.metrics_file = self.Parameters["metrics_file"] or 'metrics.prom'
+        self.snapshot_file = self.Parameters["snapshot_file"] or 'drivers.json'
+        self.device_cache = self.Parameters["device_cache"] or 'devices.cache'
+        self.persistent_session = str(self.Parameters["persistent_session"] or 'false').lower() in ('true', 'yes', '1')
+        self.client_id = self.Parameters["client_id"] or ''
+        if self.persistent_session and not self.client_id:
+            self.client_id = f"mqtt-poly-{socket.gethostname()}"
 
         # upload the device topics yaml file (multiple devices)
         if self.Parameters["devfile"] is not None:
             try:
-                x = self.Parameters["devfile"]
-                f = open(x)
+                with open(self.Parameters["devfile"], 'rb') as f:
+                    text = f.read()
             except Exception as ex:
                 LOGGER.error("Failed to open {}: {}".format(self.Parameters["devfile"], ex))
                 return False
             try:
-                dev_yaml = yaml.safe_load(f.read())  # upload devfile into data
-                f.close()
+                self.device_table = self._load_device_table(text, DeviceTable.parse_devfile)
             except Exception as ex:
                 LOGGER.error(f"checkParams: Failed to parse {self.Parameters['devfile']} content: {ex}")
                 return False
-            if "devices" not in dev_yaml:
-                LOGGER.error(f"checkParams: Manual discovery file {self.Parameters['devfile']} is missing bulbs section")
-                return False
-            self.devlist = dev_yaml["devices"]  # transfer devfile into devlist
 
         # upload the device topic from the Node Server Configuration Page
         elif self.Parameters["devlist"] is not None:
             try:
-                x= self.Parameters['devlist']
-                if type(x) == str:
-                    self.devlist = json.loads(x)
+                x = self.Parameters['devlist']
+                text = (x if type(x) == str else json.dumps(x)).encode()
+                self.device_table = self._load_device_table(text, json.loads)
             except Exception as ex:
                 LOGGER.error("Failed to parse the devlist: {}".format(ex))
                 return False
@@ -247,9 +478,18 @@ class Controller(udi_interface.Node):
             LOGGER.error("checkParams: NO devfile or devlist !!!! Must be configured!!")
             return False
 
-        self.valid_configuration = True
         return True
 
+    def _load_device_table(self, text: bytes, parse) -> DeviceTable:
+        """ compiled table of the devfile / devlist text, reused while the text is unchanged """
+        if self.device_table.digest == DeviceTable.hash(text, Controller.NODE_TYPES):
+            LOGGER.debug("device table: configuration unchanged")
+            return self.device_table
+        started = time.monotonic()
+        table = DeviceTable.load(text, parse, Controller.NODE_TYPES, self.device_cache)
+        LOGGER.info(f"device table: {len(table)} devices in {(time.monotonic() - started) * 1000:.1f}ms")
+        return table
+
     """
     Called via the CUSTOMTYPEDDATA event. This event is sent when
     the user enters or updates Custom Typed Parameters via the dashboard.
@@ -284,8 +524,14 @@ class Controller(udi_interface.Node):
     def poll(self, flag):
         if 'longPoll' in flag:
             LOGGER.debug('longPoll re-parse updateallfromserver (controller)')
+            self.log_limiter.summary()
         else:
             self.heartbeat()
+            self._report_queue_stats()
+            # not before discovery restored the previous snapshot, nor while it adds the nodes
+            if self.snapshot_interval > 0 and self.snapshot_state is not None and self.startup.is_set('nodes') \
+                    and time.monotonic() - self.snapshot_saved >= self.snapshot_interval:
+                self._save_snapshot()
             LOGGER.debug('shortPoll check for events (controller)')
 
     def query(self, command = None):
@@ -317,167 +563,163 @@ class Controller(udi_interface.Node):
         parse out the devices contained in devlist.
         """
         self.discover_nodes()
-        connected = self.mqttc.is_connected()
-        if connected:
-            self.mqtt_subscribe()
+        if self.mqttc is not None and self.mqttc.is_connected():
+            # discover_nodes() already sent the subscription delta
+            self._query_nodes()
 
     def discover_nodes(self, command = None):
-        LOGGER.info(f"discovery start")
-        self.discovery = True
-        nodes_new = []
-        for dev in self.devlist:
-            if (
-                    "id" not in dev
-                    or "status_topic" not in dev
-                    or "cmd_topic" not in dev
-                    or "type" not in dev
-            ):
-                LOGGER.error("Invalid device definition: {json.dumps(dev)}")
-                continue
-            if "name" in dev:
-                name = dev["name"]
-            else:
-                name = dev["id"]  # if there is no 'friendly name' use the ID instead
-            address = Controller._format_device_address(dev)
-            if not self.poly.getNode(address):
-                LOGGER.debug(f'Type_frog: {dev["type"]}')
-                if dev["type"] == "switch":                    
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQSwitch(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-                    
-                elif dev["type"] == "trigger":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQTrigger(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "dimmer":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQDimmer(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-                    dev['extra_status_topic'] = dev['status_topic'].rsplit('/', 1)[0] + '/RESULT'
-                    LOGGER.info(f'Adding {dev["extra_status_topic"]}')
-                    self._add_status_topics(dev, [dev['extra_status_topic']])
-                    LOGGER.info("ADDED {} {} /RESULT".format(dev['type'], name))
-
-                elif dev['type'] == "ifan":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQFan(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "sensor":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQSensor(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "dsensor":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQDroplet(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "flag":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQFlag(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "TempHumid":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQdht(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-                    # parse status_topic to add 'STATUS10' MQTT message. Handles QUERY Response
-                    extra_status_topic = dev['status_topic'].rsplit('/', 1)[0] + '/STATUS10'
-                    dev['extra_status_topic'] = extra_status_topic.replace('tele/', 'stat/')
-                    LOGGER.info(f'Adding EXTRA {dev["extra_status_topic"]} for {name}')
-                    self._add_status_topics(dev, [dev['extra_status_topic']])
-
-                elif dev['type'] == "Temp":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQds(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-                    # parse status_topic to add 'STATUS10' MQTT message. Handles QUERY Response
-                    extra_status_topic = dev['status_topic'].rsplit('/', 1)[0] + '/STATUS10'
-                    dev['extra_status_topic'] = extra_status_topic.replace('tele/', 'stat/')
-                    LOGGER.info(f'Adding EXTRA {dev["extra_status_topic"]} for {name}')
-                    self._add_status_topics(dev, [dev['extra_status_topic']])
-
-                elif dev['type'] == "TempHumidPress":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQbme(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-                    # parse status_topic to add 'STATUS10' MQTT message. Handles QUERY Response
-                    extra_status_topic = dev['status_topic'].rsplit('/', 1)[0] + '/STATUS10'
-                    dev['extra_status_topic'] = extra_status_topic.replace('tele/', 'stat/')
-                    LOGGER.info(f'Adding EXTRA {dev["extra_status_topic"]} for {name}')
-                    self._add_status_topics(dev, [dev['extra_status_topic']])
-
-                elif dev['type'] == "distance":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQhcsr(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "shellyflood":
-                    LOGGER.info(f"Adding {dev['type']} {name}")
-                    self.poly.addNode(MQShellyFlood(self.poly, self.address, address, name, dev))
-                    status_topics = dev["status_topic"]
-                    self._add_status_topics(dev, status_topics)
-
-                elif dev['type'] == "analog":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQAnalog(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-                    # parse status_topic to add 'STATUS10' MQTT message. Handles QUERY Response
-                    extra_status_topic = dev['status_topic'].rsplit('/', 1)[0] + '/STATUS10'
-                    dev['extra_status_topic'] = extra_status_topic.replace('tele/', 'stat/')
-                    LOGGER.info(f'Adding EXTRA {dev["extra_status_topic"]} for {name}')
-                    self._add_status_topics(dev, [dev['extra_status_topic']])
-
-                elif dev['type'] == "s31":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQs31(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "raw":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQraw(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "RGBW":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQRGBWstrip(self.poly, self.address, address, name, dev))
-                    self._add_status_topics(dev, [dev["status_topic"]])
-
-                elif dev['type'] == "ratgdo":
-                    LOGGER.info(f"Adding {dev['type']}, {name}")
-                    self.poly.addNode(MQratgdo(self.poly, self.address, address, name, dev))
-                    status_topics_base = dev["status_topic"] + "/status/"
-                    status_topics = [status_topics_base + "availability",
-                                     status_topics_base + "light",
-                                     status_topics_base + "door",
-                                     status_topics_base + "motion",
-                                     status_topics_base + "lock",
-                                     status_topics_base + "obstruction"]
-                    self._add_status_topics(dev, status_topics)
-
-                else:
-                    LOGGER.error("Device type {} is not yet supported".format(dev['type']))
-                    continue
-                self.wait_for_node_done()
-            nodes_new.append(address)
-        LOGGER.info("Done adding nodes.")
-        LOGGER.debug(f'DEVLIST: {self.devlist}')
+        # CUSTOMPARAMS and DISCOVER events run on their own threads, one discovery at a time
+        with self.discovery_lock:
+            LOGGER.info(f"discovery start")
+            # a (re)connect while nodes are being rebuilt subscribes afterwards
+            self.startup.clear('nodes')
+            with self.pending_lock:
+                self.discovery = True
+            try:
+                return self._discover_nodes()
+            finally:
+                self._end_discovery()
+                self.startup.mark('nodes')
+                self._subscribe_when_ready()
+                LOGGER.info(f"Done Discovery")
+
+    def _discover_nodes(self):
+        """
+        Take the devices compiled by checkParams and only touch the nodes
+        that differ from the previous discovery: new devices are added,
+        changed ones are re-created in place, missing ones are removed.
+        """
+        started = time.monotonic()
+        self.add_stats = {'added': 0, 'retries': 0, 'failed': 0, 'max': 0.0, 'total': 0.0}
+        if self.snapshot_state is None:
+            # first discovery of this run, nodes start from their last known state
+            self.snapshot_state = DriverSnapshot(self.snapshot_file).load() if self.snapshot_interval > 0 else {}
+            LOGGER.info(f"snapshot: {len(self.snapshot_state)} nodes in {self.snapshot_file}")
+        devices = self.device_table.devices
+        added, changed = [], []
+        for address, device in devices.items():
+            if address not in self.devices or not self.poly.getNode(address):
+                added.append(address)
+            elif device != self.devices[address]:
+                LOGGER.info(f"device {address} changed, updating")
+                changed.append(address)
+        removed = [a for a in self.devices if a not in devices]
+
+        for address in removed:
+            self._remove_device(address)
+        for address in added + changed:
+            self._remove_status_topics(address)
+            self._remove_sensor_routes(address)
+
+        inflight = deque()
+        for address in added + changed:
+            # nodes may add keys (sensor_id), keep the compiled copy pristine
+            dev = copy.deepcopy(devices[address].dev)
+            node = self._create_node(devices[address], dev)
+            if 'coalesce' in dev:
+                node.coalesce = bool(dev['coalesce'])  # per-device override of the type default
+            if 'drivers' in dev:
+                node.driver_filters = self._driver_filters(dev, node)
+            node.rate_limit = self._rate_limit(dev)
+            self.device_qos[address] = self._qos(dev, node)
+            self._restore_drivers(node)
+            self._add_sensor_route(dev, node)
+            self._add_node(node, inflight)
+        while inflight:
+            self._wait_node_added(*inflight.popleft())
+        self.devices = devices
+        self.snapshot_state.clear()
+        self.metric_discovery.set(round(time.monotonic() - started, 3))
+        self._log_add_stats(time.monotonic() - started)
+        LOGGER.info(f"Done adding nodes. added: {len(added)}, changed: {len(changed)}, "
+                    f"removed: {len(removed)}, unchanged: {len(devices) - len(added) - len(changed)}")
 
         # routine to remove nodes which exist but are not in devlist
         nodes = self.poly.getNodes()
-        nodes_get = {key: nodes[key] for key in nodes if key != self.id}
-        for node in nodes_get:
-            if (node not in nodes_new):
-                LOGGER.info(f"need to delete node {node}")
-                self._remove_status_topics(node)
-                self.poly.delNode(node)
-        self.discovery = False
-        LOGGER.info(f"Done Discovery")
+        for node in [key for key in nodes if key != self.id and key not in devices]:
+            self._remove_device(node)
+        if self.session_ready:
+            self._sync_subscriptions()
         return True
 
+    def _create_node(self, device, dev):
+        """ create the node object for dev and register its status topics """
+        LOGGER.debug(f'Type_frog: {device.type}')
+        LOGGER.info(f"Adding {device.type}, {device.name}")
+        node = Controller.NODE_TYPES[device.type](self.poly, self.address, device.address, device.name, dev)
+        self._add_status_topics(dev, device.status_topics)
+        return node
+
+    @staticmethod
+    def _driver_filters(dev, node) -> dict:
+        """ validate the per-driver rounding / deadband settings of a device entry """
+        filters = {}
+        if not isinstance(dev['drivers'], dict):
+            LOGGER.error(f"{dev['id']}: drivers must map driver names to settings")
+            return filters
+        known = {drv['driver'] for drv in node.drivers}
+        for driver, rule in dev['drivers'].items():
+            if driver not in known:
+                LOGGER.error(f"{dev['id']}: {node.id} has no driver {driver}")
+                continue
+            try:
+                rule = {key: float(rule[key]) for key in ('round', 'deadband', 'deadband_pct', 'max_silence')
+                        if key in rule}
+            except (TypeError, ValueError) as ex:
+                LOGGER.error(f"{dev['id']}: invalid settings for driver {driver}: {ex}")
+                continue
+            filters[driver] = rule
+        return filters
+
+    def _rate_limit(self, dev):
+        """ token bucket for the node's driver reports, device entry overrides the global setting """
+        try:
+            rate = float(dev.get('report_rate', self.report_rate))
+            burst = int(dev.get('report_burst', self.report_burst))
+        except (TypeError, ValueError) as ex:
+            LOGGER.error(f"{dev['id']}: invalid report_rate / report_burst: {ex}")
+            return None
+        return TokenBucket(rate, burst) if rate > 0 else None
+
+    def _restore_drivers(self, node):
+        """ driver values from the snapshot, set before the node is added so Polyglot gets them at once """
+        entry = self.snapshot_state.pop(node.address, None)
+        if entry is None:
+            return
+        at, drivers = entry
+        for driver in node.drivers:
+            saved = drivers.get(driver['driver'])
+            if isinstance(saved, list) and len(saved) == 2:
+                node.setDriver(driver['driver'], saved[0], report=False, uom=saved[1])
+        node.restored_at = at
+        LOGGER.debug(f"snapshot: restored {node.address}, {time.time() - at:.0f}s old")
+
+    def _save_snapshot(self):
+        self.snapshot_saved = time.monotonic()
+        nodes = [node for address, node in list(self.poly.getNodes().items()) if address != self.address]
+        count = DriverSnapshot(self.snapshot_file).save(nodes)
+        LOGGER.debug(f"snapshot: {count} nodes saved to {self.snapshot_file}")
+
+    @staticmethod
+    def _qos(dev, node) -> int:
+        """ subscription QoS of the device's status topics, device entry overrides the node type """
+        try:
+            qos = int(dev.get('qos', node.qos))
+        except (TypeError, ValueError):
+            qos = -1
+        if qos not in (0, 1, 2):
+            LOGGER.error(f"{dev['id']}: qos must be 0, 1 or 2, using {node.qos}")
+            return node.qos
+        return qos
+
+    def _remove_device(self, address):
+        LOGGER.info(f"need to delete node {address}")
+        self.device_qos.pop(address, None)
+        self._remove_status_topics(address)
+        self._remove_sensor_routes(address)
+        if self.poly.getNode(address):
+            self.poly.delNode(address)
+
     def delete(self):
         """
         This is called by Polyglot upon deletion of the NodeServer. If the
@@ -493,9 +735,23 @@ class Controller(udi_interface.Node):
         other shutdown type tasks.
         """
         LOGGER.info("MQTT is stopping")
+        self.stopping.set()
         if self.mqttc is not None:
-            self.mqttc.loop_stop()
             self.mqttc.disconnect()
+            self.connection_lost.set()
+        if self.supervisor is not None:
+            self.supervisor.join(5)
+        self._cancel_settle()
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+        if self.coalescer is not None:
+            self.coalescer.stop()
+        if self.pool is not None:
+            self.pool.stop()
+        if self.status_batcher is not None:
+            self.status_batcher.stop()
+        if self.snapshot_interval > 0 and self.snapshot_state is not None:
+            self._save_snapshot()
         self.poly.stop()
 
         LOGGER.info('MQTT stopped...')
@@ -524,129 +780,529 @@ class Controller(udi_interface.Node):
         self.Notices.clear()
 
     def _add_status_topics(self, dev, status_topics: List[str]):
+        address = Controller._format_device_address(dev)
         for status_topic in status_topics:
-            self.status_topics.append(status_topic)
-            self.status_topics_to_devices[status_topic] = Controller._format_device_address(dev)
-            # should be keyed to `id` instead of `status_topic`
-
-    def _remove_status_topics(self, node):
-        for status_topic in self.status_topics_to_devices:
-            if self.status_topics_to_devices[status_topic] == self.poly.getNode(node):
-                self.status_topics.remove(status_topic)
-                self.status_topics_to_devices.pop(status_topic)
-                LOGGER.info(f"remove topic = {status_topic}")
-            # should be keyed to `id` instead of `status_topic`
+            if not TopicTrie.valid_filter(status_topic):
+                LOGGER.error(f"Invalid status topic {status_topic} for {address}")
+                continue
+            self.status_topics.setdefault(status_topic, []).append(address)
+            self.status_topics_to_devices.add(status_topic, address)
+            self.device_topics.setdefault(address, []).append(status_topic)
+
+    def _remove_status_topics(self, address):
+        """ O(topics of the device) via the reverse index """
+        for status_topic in self.device_topics.pop(address, []):
+            owners = self.status_topics.get(status_topic, [])
+            if address in owners:
+                owners.remove(address)
+            if owners:
+                # topic shared with other sensors on the same device
+                self.status_topics_to_devices.add(status_topic, owners[-1])
+            else:
+                self.status_topics.pop(status_topic, None)
+                self.status_topics_to_devices.remove(status_topic)
+            LOGGER.info(f"remove topic = {status_topic}")
+
+    def _supervise(self):
+        """
+        Connect and keep connected.  Runs on its own thread so neither start()
+        nor paho's callbacks block on the broker; paho's network thread runs
+        one connection and ends when it is lost, then the next attempt is made
+        after an exponential, jittered backoff.
+        """
+        while not self.stopping.is_set():
+            try:
+                self.mqttc.connect(self.mqtt_server, self.mqtt_port, 10)
+            except Exception as ex:
+                delay = self.backoff.next()
+                self.log_limiter.error('mqtt connect', "Error connecting to Poly MQTT broker %s:%s: %s, retrying in %.1fs",
+                                       self.mqtt_server, self.mqtt_port, ex, delay)
+                self.Notices['mqtt'] = 'Error on user MQTT connection'
+                self.stopping.wait(delay)
+                continue
+            self.connection_lost.clear()
+            self.mqttc.loop_start()
+            self.connection_lost.wait()
+            self.mqttc.loop_stop()
+            if self.stopping.is_set():
+                break
+            delay = self.backoff.next()
+            LOGGER.warning(f"Poly MQTT reconnecting in {delay:.1f}s")
+            self.stopping.wait(delay)
 
     def _on_connect(self, mqttc, userdata, flags, rc):
         if rc == 0:
-            LOGGER.info("Poly MQTT Connected")
-            self.mqtt_subscribe()
+            self.session_present = bool(flags.get('session present'))
+            LOGGER.info(f"Poly MQTT Connected{' (session resumed)' if self.session_present else ''}")
+            self.backoff.reset()
+            with self.startup_lock:
+                self.session_ready = False
+            if self.outage_started is not None:
+                elapsed = time.monotonic() - self.outage_started
+                self.metric_reconnect.set(round(elapsed, 3))
+                self.setDriver("GV9", round(elapsed, 1))
+                self.first_message_pending = True
+                LOGGER.info(f"Poly MQTT reconnected {elapsed:.1f}s after the connection was lost")
+            self.startup.mark('connected')
+            self._subscribe_when_ready()
         else:
-            LOGGER.error("Poly MQTT Connect failed")
+            LOGGER.error(f"Poly MQTT Connect failed: {mqtt.connack_string(rc)}")
+
+    def _subscribe_when_ready(self):
+        """
+        Subscribe once per connection, as soon as the broker is connected
+        and discovery has built the topic set, whichever happens last.
+        """
+        with self.startup_lock:
+            if self.session_ready or not self.startup.is_set('connected') or not self.startup.is_set('nodes'):
+                return
+            self.session_ready = True
+        self.mqtt_subscribe()
 
     def _on_disconnect(self, mqttc, userdata, rc):
+        self.startup.clear('connected')
+        self._cancel_settle()
+        with self.sub_lock:
+            # SUBACKs still outstanding never arrive on the next connection
+            self.sub_pending.clear()
+            self.sub_started = None
+        with self.startup_lock:
+            self.session_ready = False
         if rc != 0:
-            LOGGER.warning("Poly MQTT disconnected, trying to re-connect")
-            try:
-                self.mqttc.reconnect()
-            except Exception as ex:
-                LOGGER.error("Error connecting to Poly MQTT broker {}".format(ex))
-                return False
+            if self.outage_started is None and self.startup.is_set('subscribed'):
+                self.outage_started = time.monotonic()
+                self.first_message_pending = False
+                self.metric_disconnects.inc()
+            LOGGER.warning(f"Poly MQTT disconnected: {mqtt.error_string(rc)}")
         else:
             LOGGER.info("Poly MQTT graceful disconnection")
+        # the supervisor reconnects
+        self.connection_lost.set()
+
+    def _first_message(self):
+        """ first message after an outage, the connection is fully back """
+        elapsed = time.monotonic() - self.outage_started
+        self.outage_started = None
+        self.first_message_pending = False
+        self.metric_first_message.set(round(elapsed, 3))
+        self.setDriver("GV10", round(elapsed, 1))
+        LOGGER.info(f"Poly MQTT first message {elapsed:.1f}s after the connection was lost")
 
     def _on_message(self, mqttc, userdata, message):
-        if self.discovery == True:
+        """
+        Runs on paho's network thread, so only wrap the message and hand it
+        to the worker owning the node; see _process_message.
+        """
+        self.metric_received.inc()
+        if self.first_message_pending:
+            self._first_message()
+        envelope = Envelope.from_mqtt(message)
+        with self.pending_lock:
+            if self.discovery:
+                self._buffer_message(envelope)
+                return
+        self._route(envelope)
+
+    def _route(self, envelope):
+        topic = envelope.topic
+        address, envelope.captures = self.status_topics_to_devices.match(topic)
+        node = self.poly.getNode(address)
+        if node is None:
+            self.metric_unrouted.inc()
+            self.log_limiter.error(topic, "No node subscribed to %s", topic)
+            return
+        # JSON is only parsed for node types that expect it
+        envelope.kind = Envelope.JSON if node.payload_json else Envelope.TEXT
+        if self.coalescer is not None and node.coalesce:
+            self.coalescer.offer(topic, address, (node, envelope))
+        else:
+            self._dispatch(address, (node, envelope))
+
+    def _buffer_message(self, envelope):
+        """ hold a message received during discovery, oldest is dropped when full """
+        if self.discovery_buffer <= 0:
+            # buffering disabled, routes are being rebuilt so the message is dropped
+            self.overflowed += 1
             return
-        topic = message.topic
-        payload = message.payload.decode("utf-8")
-        LOGGER.info(f"Received _on_message {payload} from {topic}")
+        if self.pending_messages and len(self.pending_messages) >= self.discovery_buffer:
+            self.pending_messages.popleft()
+            self.overflowed += 1
+        self.pending_messages.append(envelope)
+        self.buffered += 1
+
+    def _end_discovery(self):
+        """
+        Replay the held messages against the rebuilt routing before new
+        messages are let through, so per-device ordering is kept.
+        """
+        with self.pending_lock:
+            count = len(self.pending_messages)
+            while self.pending_messages:
+                self._route(self.pending_messages.popleft())
+            self.replayed += count
+            self.discovery = False
+        LOGGER.info(f"discovery replayed {count} messages (buffered: {self.buffered}, "
+                    f"replayed: {self.replayed}, overflowed: {self.overflowed})")
+
+    def _dispatch(self, address, item):
+        if not self.pool.submit(address, item):
+            self.metric_dropped.inc()
+            self.log_limiter.warning('queue full', "Message queue full, dropped message from %s", item[1].topic)
+
+    def _process_message(self, item):
+        node, envelope = item
+        topic = envelope.topic
+        self.metric_queue_wait.observe(max(0.0, time.time() - envelope.timestamp))
+        self._log_payload(envelope)
+        # a sensor lookup can resolve to the topic node itself (single sensor devices)
+        updated = set()
         try:
-            try:
-                data = json.loads(payload)
+            data = envelope.data if envelope.is_json() else None
+            if isinstance(data, dict):
                 if 'StatusSNS' in data:
                     data = data['StatusSNS']
-                    LOGGER.info(f'_StatusSNS data: {data}')
-                if 'ANALOG' in data.keys():
-                    LOGGER.info('ANALOG Payload = {}, Topic = {}'.format(payload, topic))
+                if 'ANALOG' in data:
                     for sensor in data['ANALOG']:
-                        LOGGER.info(f'_OA: {sensor}')
-                        self.poly.getNode(self._get_device_address_from_sensor_id(topic, sensor)).updateInfo(
-                            payload, topic)
-                for sensor in [sensor for sensor in data.keys() if 'DS18B20' in sensor]:
-                    LOGGER.info(f'_ODS: {sensor}')
-                    self.poly.getNode(self._get_device_address_from_sensor_id(topic, sensor)).updateInfo(payload, topic)
-                for sensor in [sensor for sensor in data.keys() if 'AM2301' in sensor]:
-                    LOGGER.info(f'_OAM: {sensor}')
-                    self.poly.getNode(self._get_device_address_from_sensor_id(topic, sensor)).updateInfo(payload, topic)
-                for sensor in [sensor for sensor in data.keys() if 'BME280' in sensor]:
-                    LOGGER.info(f'_OBM: {sensor}')
-                    self.poly.getNode(self._get_device_address_from_sensor_id(topic, sensor)).updateInfo(payload, topic)
-                else:  # if it's anything else, process as usual
-                    LOGGER.info(f'_else: Payload = {payload}, Topic = {topic}')
-                    self.poly.getNode(self._dev_by_topic(topic)).updateInfo(payload, topic)
-            except (json.decoder.JSONDecodeError, TypeError):  # if it's not a JSON, process as usual
-                LOGGER.info(f"_NotJSON: Payload = {payload}, Topic = {topic}")
-                self.poly.getNode(self._dev_by_topic(topic)).updateInfo(payload, topic)
+                        LOGGER.debug('_OA: %s', sensor)
+                        self._update_sensor(topic, sensor, envelope, updated)
+                for sensor in [sensor for sensor in data if 'DS18B20' in sensor]:
+                    LOGGER.debug('_ODS: %s', sensor)
+                    self._update_sensor(topic, sensor, envelope, updated)
+                for sensor in [sensor for sensor in data if 'AM2301' in sensor]:
+                    LOGGER.debug('_OAM: %s', sensor)
+                    self._update_sensor(topic, sensor, envelope, updated)
+                for sensor in [sensor for sensor in data if 'BME280' in sensor]:
+                    LOGGER.debug('_OBM: %s', sensor)
+                    self._update_sensor(topic, sensor, envelope, updated)
+            # anything else on the topic is processed as usual
+            if node.address not in updated:
+                self._update_node(node, envelope)
         except Exception as ex:
-            LOGGER.error("Failed to process message {}".format(ex))
+            self.log_limiter.error(f'{node.address}: process', "Failed to process message from %s: %s", topic, ex)
+
+    def _update_sensor(self, topic, sensor_id, envelope, updated):
+        """ update the node of one sensor of a multi-sensor payload, each node once per message """
+        node = self._get_node_from_sensor_id(topic, sensor_id)
+        if node.address in updated:
+            return
+        updated.add(node.address)
+        self._update_node(node, envelope)
+
+    def _update_node(self, node, envelope):
+        """ node.updateInfo, timed and counted per node type """
+        started = time.perf_counter()
+        try:
+            result = node.updateInfo(envelope)
+        except Exception:
+            self.metric_update_errors.inc(type=node.id)
+            raise
+        finally:
+            self.metric_update.observe(time.perf_counter() - started, type=node.id)
+        if result is False:
+            self.metric_update_errors.inc(type=node.id)
+        else:
+            node.updated_at = envelope.timestamp
+            if envelope.retain:
+                node.retained_at = envelope.timestamp
+        return result
+
+    def _log_payload(self, envelope):
+        """
+        Every payload at DEBUG, at INFO only one per topic per
+        log_sample_interval; nothing is decoded or formatted otherwise.
+        """
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('Received %s from %s', envelope.text, envelope.topic)
+        elif LOGGER.isEnabledFor(logging.INFO):
+            skipped = self.log_limiter.sample(envelope.topic)
+            if skipped is not None:
+                LOGGER.info('Received %s from %s (%d not logged since the last one)',
+                            envelope.text, envelope.topic, skipped)
+
+    def _report_queue_stats(self):
+        if self.pool is not None:
+            self.setDriver("GV0", self.pool.depth())
+            self.setDriver("GV1", self.pool.dropped)
+        if self.coalescer is not None:
+            LOGGER.debug(f'coalesced messages: {self.coalescer.coalesced}')
+        LOGGER.debug(f'duplicate status queries skipped: {self.status_queries_skipped}')
+        sent = suppressed = limited = 0
+        for node in list(self.poly.getNodes().values()):
+            sent += getattr(node, 'updates_sent', 0)
+            suppressed += getattr(node, 'updates_suppressed', 0)
+            limited += getattr(node, 'reports_limited', 0)
+        self.setDriver("GV4", suppressed)
+        self.setDriver("GV5", limited)
+        LOGGER.debug(f'driver updates sent: {sent}, suppressed by deadband: {suppressed}, '
+                     f'held by rate limit: {limited}')
+        if self.status_batcher is not None:
+            flushes, updates, largest = self.status_batcher.take_stats()
+            self.setDriver("GV3", round(updates / flushes) if flushes else 0)
+            LOGGER.debug(f'status uplink: {updates} driver updates in {flushes} messages, '
+                         f'largest {largest}, replaced before sending {self.status_batcher.replaced}')
+        self._report_metrics()
+
+    def _report_metrics(self):
+        """ summary drivers over the last shortPoll, and the metrics file when due """
+        now = time.monotonic()
+        received = self.metric_received.total()
+        busy, updates = self.metric_update.totals()
+        polled_at, last_received, last_busy, last_updates = self.metrics_polled
+        self.metrics_polled = (now, received, busy, updates)
+        elapsed = now - polled_at
+        if elapsed > 0:
+            self.setDriver("GV6", round((received - last_received) / elapsed, 1))
+        count = updates - last_updates
+        self.setDriver("GV7", round(1000 * (busy - last_busy) / count, 1) if count else 0)
+        self.setDriver("GV8", self.metric_update_errors.total() + self.metric_unrouted.total()
+                       + self.metric_dropped.total() + self.metric_publish_errors.total())
+        if self.metrics_interval > 0 and now - self.metrics_written >= self.metrics_interval:
+            self.metrics_written = now
+            self.metrics.write(self.metrics_file)
 
     def _dev_by_topic(self, topic):
-        LOGGER.debug(f'STATUS TO DEVICES = {self.status_topics_to_devices.get(topic, None)}')
-        return self.status_topics_to_devices.get(topic, None)
-
-    def _get_device_address_from_sensor_id(self, topic, sensor_type):
-        LOGGER.debug(f'GDA1: topic: {topic}  sensor_type: {sensor_type}')
-        LOGGER.debug(f'GDA1b: devlist: {self.devlist}')
-        self.node_id = None
-        for device in self.devlist:
-            LOGGER.debug(f'GDA2: device: {device}')
-            if 'sensor_id' in device:
-                if topic.rsplit('/')[1] in device['status_topic'] and sensor_type in device['sensor_id']:
-                    self.node_id = device['id'].lower().replace("_", "").replace("-", "_")[:14]
-                    LOGGER.debug(f'GDA2b: NODE_ID: {self.node_id}, {topic}, {sensor_type}')
-                    break
-        LOGGER.debug(f'GDA3: NODE_ID2: {self.node_id}')
-        if self.node_id == None:
-            self.node_id = self._dev_by_topic(topic)
-            LOGGER.debug(f'GDA4: revert to topic NODE_ID3: {self.node_id}')
-        return self.node_id
+        address, _ = self.status_topics_to_devices.match(topic)
+        LOGGER.debug('STATUS TO DEVICES = %s', address)
+        return address
+
+    def _get_node_from_sensor_id(self, topic, sensor_id):
+        """
+        O(1) lookup of a multi-sensor node by (device base topic, sensor_id),
+        falling back to the node subscribed to the topic itself.
+        """
+        node = self.sensor_routes.get((Controller._device_base_topic(topic), sensor_id))
+        if node is None:
+            # devices defined with a wildcard base, e.g. tele/+/SENSOR
+            node = self.sensor_routes.get(('+', sensor_id))
+        if node is None:
+            node = self.poly.getNode(self._dev_by_topic(topic))
+            LOGGER.debug('GDA: revert to topic %s for %s', topic, sensor_id)
+        return node
+
+    def _add_sensor_route(self, dev, node):
+        """
+        Index a sensor node under its device base topic so that Tasmota
+        SENSOR / STATUS10 payloads can be routed without scanning devlist.
+        """
+        if 'sensor_id' not in dev or not isinstance(dev['status_topic'], str):
+            return
+        key = (Controller._device_base_topic(dev['status_topic']), dev['sensor_id'])
+        self.sensor_routes[key] = node
+        self.sensor_route_keys[node.address] = key
+        LOGGER.debug(f'sensor route {key} -> {node.address}')
+
+    def _remove_sensor_routes(self, address):
+        key = self.sensor_route_keys.pop(address, None)
+        if key is not None and key in self.sensor_routes and self.sensor_routes[key].address == address:
+            self.sensor_routes.pop(key)
+            LOGGER.info(f"remove sensor route = {key}")
+
+    @staticmethod
+    def _device_base_topic(topic: str) -> str:
+        # e.g. tele/Wemos32/SENSOR and stat/Wemos32/STATUS10 both -> Wemos32
+        parts = topic.split('/')
+        return parts[1] if len(parts) > 1 else topic
 
     @staticmethod
     def _format_device_address(dev) -> str:
-        return dev["id"].lower().replace("_", "").replace("-", "_")[:14]
+        return DeviceTable.format_address(dev)
 
     def mqtt_pub(self, topic, message):
-        LOGGER.debug(f"mqtt_pub: topic: {topic}, message: {message}")
-        self.mqttc.publish(topic, message, retain=False)
+        LOGGER.debug("mqtt_pub: topic: %s, message: %s", topic, message)
+        result = self.mqttc.publish(topic, message, retain=False)
+        self.metric_published.inc()
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.metric_publish_errors.inc()
+            self.log_limiter.error(f'publish {topic}', "Failed to publish to %s: %s", topic, mqtt.error_string(result.rc))
+
+    def query_status(self, query_topic):
+        """
+        Send 'Status 10' to a Tasmota device at most once per
+        status_query_window, however many of its sensor nodes are queried.
+        The single STATUS10 reply is fanned out to all of them by
+        _process_message.
+        """
+        now = time.monotonic()
+        with self.status_query_lock:
+            last = self.status_queried.get(query_topic)
+            if last is not None and now - last < self.status_query_window:
+                self.status_queries_skipped += 1
+                LOGGER.debug(f"query_status: {query_topic} already requested {now - last:.1f}s ago")
+                return False
+            self.status_queried[query_topic] = now
+        self.mqtt_pub(query_topic, " 10")
+        return True
 
     def mqtt_subscribe(self):
+        """
+        Called on every (re)connect.  A clean session has no subscriptions
+        left, so the whole deduplicated topic set is sent again.  When the
+        broker resumed a persistent session it still has them and has queued
+        the QoS 1 messages missed meanwhile, so only the changes made while
+        disconnected are sent and nodes are not queried again.
+        """
+        if self.persistent_session and self.session_present and self.subscribed:
+            LOGGER.info("Poly MQTT session resumed, keeping subscriptions")
+            self._sync_subscriptions()
+            with self.sub_lock:
+                if not self.sub_pending:
+                    self.startup.mark('subscribed')
+            return
         LOGGER.info("Poly MQTT subscribing...")
-        result = 255
-        results = []
-        for stopic in self.status_topics:
-            results.append((stopic, tuple(self.mqttc.subscribe(stopic))))
-        for (topic, (result, mid)) in results:
-            if result == 0:
-                LOGGER.info(
-                    "Subscribed to {} MID: {}, res: {}".format(topic, mid, result)
-                )
-            else:
-                LOGGER.error(
-                    "Failed to subscribe {} MID: {}, res: {}".format(
-                        topic, mid, result
-                    )
-                )
-        for node in self.poly.getNodes():
-            if node != self.address:
-                self.poly.getNode(node).query()
+        with self.sub_lock:
+            self.subscribed.clear()
+        self._sync_subscriptions()
+        with self.sub_lock:
+            if not self.sub_pending:
+                self.startup.mark('subscribed')
+        if self.retained_settle > 0:
+            with self.sub_lock:
+                self.settle_started = time.time()
+                self._start_settle(fallback=bool(self.sub_pending))
+        else:
+            self._query_nodes()
         LOGGER.info("Subscriptions Done")
 
+    def _start_settle(self, fallback=False):
+        """
+        All subscriptions are acknowledged, so the broker is sending the
+        retained messages; nodes are queried when the settle window ends.
+        With fallback SUBACKs are still outstanding and the window starts
+        suback_timeout seconds later, so the query is never lost; the last
+        SUBACK replaces it with the regular window.  Called with sub_lock held.
+        """
+        if self.settle_timer is not None:
+            if not self.settle_fallback:
+                return
+            self.settle_timer.cancel()
+        self.settle_fallback = fallback
+        delay = self.retained_settle + (self.suback_timeout if fallback else 0.0)
+        self.settle_timer = threading.Timer(delay, self._end_settle)
+        self.settle_timer.daemon = True
+        self.settle_timer.start()
+
+    def _end_settle(self):
+        """ query only the nodes the retained messages did not give a state """
+        with self.sub_lock:
+            # a timer replaced while it was firing does not query again
+            if self.settle_started is None or threading.current_thread() is not self.settle_timer:
+                return
+            started = self.settle_started
+            if self.settle_fallback:
+                LOGGER.warning(f"retained warm start: SUBACKs missing after {self.suback_timeout:g}s, querying anyway")
+        seeded = {address for address, node in list(self.poly.getNodes().items())
+                  if address != self.address and node.retained_at is not None and node.retained_at >= started}
+        LOGGER.info(f"retained warm start: {len(seeded)} nodes got retained state within {self.retained_settle:g}s")
+        self._query_nodes(skip=seeded)
+        with self.sub_lock:
+            if threading.current_thread() is self.settle_timer:
+                self.settle_started = None
+                self.settle_timer = None
+
+    def _cancel_settle(self):
+        with self.sub_lock:
+            self.settle_started = None
+            if self.settle_timer is not None:
+                self.settle_timer.cancel()
+                self.settle_timer = None
+
+    def _sync_subscriptions(self):
+        """
+        Send only the difference between the wanted topics and what the
+        broker already has, as multi-topic SUBSCRIBE / UNSUBSCRIBE packets
+        of at most subscribe_chunk topics.
+        """
+        with self.sub_lock:
+            wanted = {topic: self._topic_qos(topic) for topic in self.status_topics}
+            new = sorted(topic for topic, qos in wanted.items() if self.subscribed.get(topic) != qos)
+            gone = sorted(topic for topic in self.subscribed if topic not in wanted)
+            if not new and not gone:
+                return
+            self.sub_started = time.monotonic()
+            for i in range(0, len(gone), self.subscribe_chunk):
+                chunk = gone[i:i + self.subscribe_chunk]
+                result, mid = self.mqttc.unsubscribe(chunk)
+                if result == 0:
+                    for topic in chunk:
+                        self.subscribed.pop(topic, None)
+                    LOGGER.info(f"Unsubscribed {len(chunk)} topics MID: {mid}")
+                else:
+                    LOGGER.error(f"Failed to unsubscribe {chunk} res: {result}")
+            for i in range(0, len(new), self.subscribe_chunk):
+                chunk = new[i:i + self.subscribe_chunk]
+                result, mid = self.mqttc.subscribe([(topic, wanted[topic]) for topic in chunk])
+                if result == 0:
+                    self.subscribed.update((topic, wanted[topic]) for topic in chunk)
+                    self.sub_pending[mid] = chunk
+                    LOGGER.info(f"Subscribing to {len(chunk)} topics MID: {mid}")
+                else:
+                    LOGGER.error(f"Failed to subscribe {chunk} res: {result}")
+            LOGGER.info(f"Subscription delta sent: +{len(new)} -{len(gone)} topics")
+
+    def _topic_qos(self, topic) -> int:
+        """ highest QoS wanted by the devices sharing a topic """
+        return max((self.device_qos.get(address, 0) for address in self.status_topics.get(topic, [])), default=0)
+
+    def _on_subscribe(self, mqttc, userdata, mid, granted_qos):
+        with self.sub_lock:
+            topics = self.sub_pending.pop(mid, [])
+            refused = [topic for topic, qos in zip(topics, granted_qos) if qos >= 0x80]
+            if refused:
+                # not subscribed, so the next sync asks for them again
+                for topic in refused:
+                    self.subscribed.pop(topic, None)
+                LOGGER.error(f"Broker refused {len(refused)} of the {len(topics)} topics in MID: {mid}: {refused}")
+            if not self.sub_pending and self.sub_started is not None:
+                self.subscribe_latency = time.monotonic() - self.sub_started
+                self.sub_started = None
+                LOGGER.info(f"All subscriptions acknowledged in {self.subscribe_latency * 1000:.0f} ms")
+                self.startup.mark('subscribed')
+                if self.settle_started is not None:
+                    self._start_settle()
+
+    def _query_nodes(self, skip=()):
+        """
+        Hand every device node, except the addresses in skip, to the
+        scheduler, actuators first, instead of querying them all at once
+        right after a (re)connect.
+        """
+        nodes = self.poly.getNodes()
+        devices = [nodes[address] for address in list(nodes) if address != self.address and address not in skip]
+        if self.first_query_round:
+            # nodes restored from a recent snapshot are not queried on the first round
+            self.first_query_round = False
+            now = time.time()
+            stale = [node for node in devices
+                     if node.restored_at is None or now - node.restored_at >= self.snapshot_max_age]
+            LOGGER.info(f"Not querying {len(devices) - len(stale)} nodes restored from a snapshot "
+                        f"younger than {self.snapshot_max_age:.0f}s")
+            devices = stale
+        if self.scheduler is None:
+            for node in devices:
+                node.query()
+            return
+        LOGGER.info(f"Scheduling queries for {len(devices)} nodes over {self.query_window}s")
+        self.scheduler.schedule(devices, lambda node: getattr(node, 'query_priority', 1))
+
+    def _report_query_progress(self, done, total):
+        self.setDriver("GV2", 100 if total == 0 else int(100 * done / total))
+
 
     # Status that this node has. Should match the 'sts' section
     # of the nodedef file.
     drivers = [
         {"driver": "ST", "value": 1, "uom": 2, "name": "NS Online"},
+        {"driver": "GV0", "value": 0, "uom": 56, "name": "Queue Depth"},
+        {"driver": "GV1", "value": 0, "uom": 56, "name": "Dropped Messages"},
+        {"driver": "GV2", "value": 0, "uom": 51, "name": "Query Progress"},
+        {"driver": "GV3", "value": 0, "uom": 56, "name": "Updates per Flush"},
+        {"driver": "GV4", "value": 0, "uom": 56, "name": "Suppressed Updates"},
+        {"driver": "GV5", "value": 0, "uom": 56, "name": "Rate Limited Reports"},
+        {"driver": "GV6", "value": 0, "uom": 56, "name": "Messages per Second"},
+        {"driver": "GV7", "value": 0, "uom": 42, "name": "Avg Processing Time"},
+        {"driver": "GV8", "value": 0, "uom": 56, "name": "Message Errors"},
+        {"driver": "GV9", "value": 0, "uom": 58, "name": "Reconnect Time"},
+        {"driver": "GV10", "value": 0, "uom": 58, "name": "First Message Time"},
     ]
 
     # Commands that this node can handle.  Should match the
@@ -0,0 +1,152 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+DeviceTable
+
+The devfile / devlist compiled into an immutable table of devices keyed by
+node address, with the status topics of every device (STATUS10, RESULT and
+the ratgdo topics included) derived once at compile time.  The supported
+types and their topics come from the node classes (status_topics), given
+as {type: node class}.
+
+Compiled tables are cached in a JSON file keyed by the SHA-256 of the
+configuration text and the supported types, so an unchanged configuration
+is loaded without parsing the YAML again:
+
+    {"version": 1, "digest": "<sha256>", "devices": [[address, type, name, sensor_id, [topics], {device}]]}
+"""
+
+import udi_interface
+import copy
+import hashlib
+import json
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Tuple
+import yaml
+
+from nodes import write_atomic
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml, when PyYAML was built with it
+except ImportError:
+    from yaml import SafeLoader
+
+LOGGER = udi_interface.LOGGER
+
+VERSION = 1
+
+REQUIRED_KEYS = ('id', 'status_topic', 'cmd_topic', 'type')
+
+
+class Device(NamedTuple):
+    address: str
+    type: str
+    name: str
+    sensor_id: Optional[str]
+    status_topics: Tuple[str, ...]
+    # device entry incl. extra_status_topic; nodes add keys, so hand them a copy
+    dev: dict
+
+
+class DeviceTable(object):
+
+    def __init__(self, devices, digest=None):
+        self.devices = MappingProxyType(devices)
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.devices)
+
+    @staticmethod
+    def format_address(dev) -> str:
+        return dev["id"].lower().replace("_", "").replace("-", "_")[:14]
+
+    @staticmethod
+    def hash(text: bytes, node_types) -> str:
+        """ a new device type changes the key, entries of it were left out before """
+        digest = hashlib.sha256(text)
+        digest.update(','.join(sorted(node_types)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def parse_devfile(text: bytes) -> list:
+        """ devices section of a devfile """
+        data = yaml.load(text, Loader=SafeLoader)
+        if not isinstance(data, dict) or "devices" not in data:
+            raise ValueError("missing devices section")
+        return data["devices"]
+
+    @classmethod
+    def compile(cls, devlist, node_types, digest=None) -> 'DeviceTable':
+        """ validate the device entries, invalid ones are logged and left out """
+        devices = {}
+        if not isinstance(devlist, list):
+            raise ValueError("devices must be a list")
+        for dev in devlist:
+            if not isinstance(dev, dict) or any(key not in dev for key in REQUIRED_KEYS):
+                LOGGER.error(f"Invalid device definition: {json.dumps(dev, default=str)}")
+                continue
+            if dev['type'] not in node_types:
+                LOGGER.error("Device type {} is not yet supported".format(dev['type']))
+                continue
+            dev = copy.deepcopy(dev)
+            try:
+                topics = node_types[dev['type']].status_topics(dev)
+            except (AttributeError, TypeError):
+                LOGGER.error(f"Invalid status_topic for {dev['id']}: {dev['status_topic']}")
+                continue
+            address = cls.format_address(dev)
+            if address in devices:
+                LOGGER.warning(f"{dev['id']} has the same address {address} as {devices[address].dev['id']}, "
+                               f"the last one is used")
+            devices[address] = Device(address, dev['type'], dev.get('name', dev['id']),
+                                      dev.get('sensor_id'), topics, dev)
+        return cls(devices, digest)
+
+    @classmethod
+    def load(cls, text: bytes, parse, node_types, cache_path=None) -> 'DeviceTable':
+        """
+        Table of the configuration text, from cache_path when it was compiled
+        from the same text, else parsed with parse(text), compiled and cached.
+        """
+        digest = cls.hash(text, node_types)
+        if cache_path:
+            table = cls._read_cache(cache_path, digest)
+            if table is not None:
+                return table
+        table = cls.compile(parse(text), node_types, digest)
+        if cache_path:
+            table._write_cache(cache_path)
+        return table
+
+    @classmethod
+    def _read_cache(cls, path, digest) -> Optional['DeviceTable']:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as ex:
+            LOGGER.warning(f'device cache: failed to read {path}: {ex}')
+            return None
+        if not isinstance(data, dict) or data.get('version') != VERSION or data.get('digest') != digest:
+            return None  # another configuration, or format
+        try:
+            devices = {}
+            for address, dev_type, name, sensor_id, topics, dev in data['devices']:
+                devices[address] = Device(address, dev_type, name, sensor_id, tuple(topics), dev)
+        except (KeyError, TypeError, ValueError) as ex:
+            LOGGER.warning(f'device cache: bad entry in {path}, recompiling: {ex}')
+            return None
+        return cls(devices, digest)
+
+    def _write_cache(self, path):
+        """ replace the cache atomically; entries JSON cannot hold (e.g. YAML dates) leave it unwritten """
+        data = {'version': VERSION, 'digest': self.digest,
+                'devices': [list(device) for device in self.devices.values()]}
+        try:
+            write_atomic(path, lambda f: json.dump(data, f, separators=(',', ':')))
+        except (OSError, TypeError, ValueError) as ex:
+            LOGGER.warning(f'device cache: failed to write {path}: {ex}')
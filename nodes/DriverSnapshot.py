@@ -0,0 +1,71 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+DriverSnapshot
+
+Last known driver values of the device nodes, kept in a small JSON file so
+a restarted plugin shows them at once instead of the class defaults:
+
+    {"version": 1, "nodes": {"<address>": {"at": <unix time>, "drivers": {"ST": [100, 78]}}}}
+
+"at" is when the node last received a message, so the age of each entry
+is known when it is loaded.
+"""
+
+import udi_interface
+import json
+
+from nodes import write_atomic
+
+LOGGER = udi_interface.LOGGER
+
+VERSION = 1
+
+
+class DriverSnapshot(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self) -> dict:
+        """ {address: (at, {driver: [value, uom]})}, empty if there is no usable file """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as ex:
+            LOGGER.error(f'snapshot: failed to read {self.path}: {ex}')
+            return {}
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            LOGGER.warning(f'snapshot: {self.path} has an unknown format, ignored')
+            return {}
+        entries = {}
+        for address, entry in data.get('nodes', {}).items():
+            try:
+                entries[address] = (float(entry['at']), dict(entry['drivers']))
+            except (KeyError, TypeError, ValueError):
+                LOGGER.warning(f'snapshot: bad entry for {address}, ignored')
+        return entries
+
+    def save(self, nodes) -> int:
+        """
+        Write the drivers of the nodes that have a known state, replacing
+        the file atomically.  Returns the number of nodes written.
+        """
+        entries = {}
+        for node in nodes:
+            at = node.updated_at or node.restored_at
+            if at is None:
+                continue  # never heard from, its values are only the defaults
+            entries[node.address] = {'at': round(at, 1),
+                                     'drivers': {d['driver']: [d['value'], d['uom']] for d in node.drivers}}
+        try:
+            write_atomic(self.path, lambda f: json.dump({'version': VERSION, 'nodes': entries}, f,
+                                                        separators=(',', ':')))
+        except (OSError, TypeError, ValueError) as ex:
+            LOGGER.error(f'snapshot: failed to write {self.path}: {ex}')
+            return 0
+        return len(entries)
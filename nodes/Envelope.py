@@ -0,0 +1,72 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+Envelope
+
+One received MQTT message, built once by the controller and handed to
+every node that the message is routed to.  The payload is only decoded
+(and, for JSON node types, parsed) the first time it is asked for.
+"""
+
+import json
+import time
+
+_UNSET = object()
+
+
+class Envelope(object):
+    TEXT = 'text'
+    JSON = 'json'
+
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'timestamp', 'kind', 'captures', '_text', '_data')
+
+    def __init__(self, topic: str, payload: bytes, qos=0, retain=False, kind=TEXT, timestamp=None):
+        """
+        :param topic: MQTT topic the message was received on
+        :param payload: raw payload bytes
+        :param kind: Envelope.JSON when the receiving node type expects JSON
+        """
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.kind = kind
+        self.timestamp = time.time() if timestamp is None else timestamp
+        # topic segments matched by + / # when the device uses a wildcard topic
+        self.captures = ()
+        self._text = _UNSET
+        self._data = _UNSET
+
+    @classmethod
+    def from_mqtt(cls, message, kind=TEXT):
+        """ wrap a paho MQTTMessage """
+        return cls(message.topic, message.payload, message.qos, message.retain, kind)
+
+    @property
+    def text(self) -> str:
+        """ payload decoded as utf-8, decoded on first use """
+        if self._text is _UNSET:
+            payload = self.payload
+            self._text = payload.decode("utf-8") if isinstance(payload, (bytes, bytearray)) else str(payload)
+        return self._text
+
+    @property
+    def data(self):
+        """
+        payload parsed as JSON on first use, shared by every node the message
+        is routed to.  None if the payload is not valid JSON.
+        """
+        if self._data is _UNSET:
+            try:
+                self._data = json.loads(self.text)
+            except (json.decoder.JSONDecodeError, TypeError, UnicodeDecodeError):
+                self._data = None
+        return self._data
+
+    def is_json(self) -> bool:
+        return self.kind == Envelope.JSON
+
+    def __repr__(self):
+        return f'Envelope({self.topic}, {self.payload!r})'
@@ -0,0 +1,87 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+LogLimiter
+
+Keeps the message path from flooding the log.  Payload logging is
+sampled per topic (at most one line per topic per sample_interval), and
+a repeated error or warning with the same key is only written once per
+repeat_interval, the next line carrying the number of repeats that were
+suppressed in between.  Messages use logging's lazy %-style arguments so
+nothing is formatted for a line that is not written.
+"""
+
+import udi_interface
+import logging
+import threading
+import time
+
+LOGGER = udi_interface.LOGGER
+
+
+class LogLimiter(object):
+
+    def __init__(self, repeat_interval=60.0, sample_interval=60.0):
+        """
+        :param repeat_interval: seconds a repeated error / warning is held back
+        :param sample_interval: seconds between payload lines of one topic, 0 = log every payload
+        """
+        self.repeat_interval = float(repeat_interval)
+        self.sample_interval = float(sample_interval)
+        self.repeats = {}  # key -> [last written, suppressed since]
+        self.samples = {}  # topic -> [last written, skipped since]
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def error(self, key, message, *args) -> bool:
+        return self.log(logging.ERROR, key, message, *args)
+
+    def warning(self, key, message, *args) -> bool:
+        return self.log(logging.WARNING, key, message, *args)
+
+    def log(self, level, key, message, *args) -> bool:
+        """ write message unless key was written less than repeat_interval ago """
+        if not LOGGER.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            entry = self.repeats.get(key)
+            if entry is not None and now - entry[0] < self.repeat_interval:
+                entry[1] += 1
+                self.suppressed += 1
+                return False
+            repeated = entry[1] if entry is not None else 0
+            self.repeats[key] = [now, 0]
+        if repeated:
+            LOGGER.log(level, message + ' (%d more suppressed)', *args, repeated)
+        else:
+            LOGGER.log(level, message, *args)
+        return True
+
+    def sample(self, topic):
+        """
+        Returns None when a payload of topic should not be logged now, else
+        the number of payloads skipped on that topic since the last one logged.
+        """
+        if self.sample_interval <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            entry = self.samples.get(topic)
+            if entry is not None and now - entry[0] < self.sample_interval:
+                entry[1] += 1
+                return None
+            skipped = entry[1] if entry is not None else 0
+            self.samples[topic] = [now, 0]
+        return skipped
+
+    def summary(self):
+        """ log what is being suppressed, called from longPoll """
+        with self._lock:
+            pending = [(key, entry[1]) for key, entry in self.repeats.items() if entry[1]]
+        for key, count in pending:
+            LOGGER.warning('%s: %d repeated lines suppressed', key, count)
+        if pending:
+            LOGGER.info('LogLimiter: %d lines suppressed since start', self.suppressed)
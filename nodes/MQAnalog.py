@@ -9,13 +9,18 @@ General purpose Analog input using ADC.
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
 
-class MQAnalog(udi_interface.Node):
+class MQAnalog(MQNode):
     id = 'mqanal'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
+    extra_status = 'STATUS10'
 
     """
     This is the class that all the Nodes will be represented by. You will
@@ -41,27 +46,26 @@ class MQAnalog(udi_interface.Node):
         LOGGER.debug(f'CMD_ID {self.sensor_id}, {self.cmd_topic}')
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload as Json: {} {}".format(ex, payload))
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
-        LOGGER.debug(f'XXX {self.sensor_id}, {data} ')
+        LOGGER.debug('XXX %s, %s', self.sensor_id, data)
         if 'StatusSNS' in data:
             data = data['StatusSNS']
         if "ANALOG" in data:
             self.setDriver("ST", 1)
-            LOGGER.debug(f'sensor_id UpdateInfo: {self.sensor_id}')
+            LOGGER.debug('sensor_id UpdateInfo: %s', self.sensor_id)
             if self.sensor_id != 'SINGLE_SENSOR':
                 self.setDriver("GPV", data["ANALOG"][self.sensor_id])
-                LOGGER.info(f'M-analog {self.sensor_id}:  {data["ANALOG"][self.sensor_id]}')
+                LOGGER.debug('M-analog %s: %s', self.sensor_id, data["ANALOG"][self.sensor_id])
             else:
                 for key, value in data['ANALOG'].items():  # look for the ONLY reading inside 'ANALOG'
-                    LOGGER.info(f'single analog {key}: {value}')
+                    LOGGER.debug('single analog %s: %s', key, value)
                     self.setDriver("GPV", value)
         else:
-            LOGGER.debug(f'NOANALOG: {self.sensor_id}')
+            LOGGER.debug('NOANALOG: %s', self.sensor_id)
             self.setDriver("ST", 0)
             self.setDriver("GPV", 0)
 
@@ -74,7 +78,7 @@ class MQAnalog(udi_interface.Node):
         LOGGER.debug(f'QUERY: {self.sensor_id}')
         query_topic = self.cmd_topic.rsplit('/', 1)[0] + '/Status'
         LOGGER.debug(f'QT: {query_topic}')
-        self.controller.mqtt_pub(query_topic, " 10")
+        self.controller.query_status(query_topic)
         self.reportDrivers()
 
     # all the drivers - for reference
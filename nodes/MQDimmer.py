@@ -10,12 +10,17 @@ node MQDimmer
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQDimmer(udi_interface.Node):
+class MQDimmer(MQNode):
     id = 'mqdimmer'
+    payload_json = True
+    coalesce = False
+    query_priority = 0
+    qos = 1
+    extra_status = 'RESULT'
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -35,28 +40,28 @@ class MQDimmer(udi_interface.Node):
         self.status_topic = device['status_topic']
         self.dimmer = 0
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
         power = ''
         dimmer = ''
         try:
-            data = json.loads(payload)
+            data = message.data
             if 'Dimmer' in data:
                 dimmer = int(data['Dimmer'])
             else:
                 dimmer = self.dimmer
             if 'POWER' in data:
                 power = data['POWER']
-            LOGGER.info("Dimmer = {} , Power = {}".format(dimmer, power))
+            LOGGER.debug("Dimmer = %s , Power = %s", dimmer, power)
         except Exception as ex:
-            LOGGER.error(f"Could not decode payload {payload}: {ex}")
+            self.log_error("Could not decode payload %s: %s", message.text, ex)
             return False
         if power == 'ON' or (self.dimmer == 0 and dimmer > 0):
-            self.reportCmd("DON")
             self.dimmer = dimmer
             self.setDriver('ST', self.dimmer)
+            self.reportCmd("DON")
         if power == 'OFF' or (self.dimmer > 0 and dimmer == 0):
-            self.reportCmd("DOF")
             self.setDriver('ST', 0)
+            self.reportCmd("DOF")
 
     def set_on(self, command):
         try:
@@ -7,12 +7,16 @@ node MQDroplet
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQDroplet(udi_interface.Node):
+class MQDroplet(MQNode):
     id = 'mqdrop'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -33,11 +37,10 @@ class MQDroplet(udi_interface.Node):
         self.on = False
         self.motion = False        
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload as Json: {} {}".format(ex, payload))
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False        
         
         # flow
@@ -7,12 +7,16 @@ node MQFan
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQFan(udi_interface.Node):
+class MQFan(MQNode):
     id = 'mqfan'
+    payload_json = True
+    coalesce = False
+    query_priority = 0
+    qos = 1
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -31,22 +35,22 @@ class MQFan(udi_interface.Node):
         self.cmd_topic = device["cmd_topic"]
         self.fan_speed = 0
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
         fan_speed = 0
         try:
-            json_payload = json.loads(payload)
+            json_payload = message.data
             fan_speed = int(json_payload['FanSpeed'])
         except Exception as ex:
-            LOGGER.error(f"Could not decode payload {payload}: {ex}")
+            self.log_error("Could not decode payload %s: %s", message.text, ex)
         if 4 < fan_speed < 0:
-            LOGGER.error(f"Unexpected Fan Speed {fan_speed}")
+            self.log_error("Unexpected Fan Speed %s", fan_speed)
             return
-        if self.fan_speed == 0 and fan_speed > 0:
+        previous, self.fan_speed = self.fan_speed, fan_speed
+        self.setDriver("ST", self.fan_speed)
+        if previous == 0 and fan_speed > 0:
             self.reportCmd("DON")
-        if self.fan_speed > 0 and fan_speed == 0:
+        if previous > 0 and fan_speed == 0:
             self.reportCmd("DOF")
-        self.fan_speed = fan_speed
-        self.setDriver("ST", self.fan_speed)
 
     def set_on(self, command):
         try:
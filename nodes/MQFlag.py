@@ -26,11 +26,16 @@ example condition: IOT devices sensor connections {OK, NOK, ERR(OR)}
 """
 
 import udi_interface
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQFlag(udi_interface.Node):
+class MQFlag(MQNode):
     id = 'mqflag'
+    payload_json = False
+    coalesce = False
+    query_priority = 1
+    qos = 1
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -48,7 +53,8 @@ class MQFlag(udi_interface.Node):
         self.controller = self.poly.getNode(self.primary)
         self.cmd_topic = device["cmd_topic"]
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
+        payload = message.text
         if payload == "OK":
             self.setDriver("ST", 0)
         elif payload == "NOK":
@@ -74,7 +80,7 @@ class MQFlag(udi_interface.Node):
         elif payload == "---":
             self.setDriver("ST", 12)
         else:
-            LOGGER.error("Invalid payload {}".format(payload))
+            self.log_error("Invalid payload %s", payload)
             payload = "ERR"
             self.setDriver("ST", 4)
 
@@ -0,0 +1,217 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+MQNode
+
+Base class of the device nodes.  Driver reports are handed to the
+controller's StatusBatcher when one is running, so that the changes of
+many nodes reach Polyglot in a few bulk messages.  Without a batcher the
+udi_interface behaviour (one message per report) is kept.
+
+A device entry may also set per-driver filters, applied in setDriver:
+    "drivers": {"GPV": {"round": 1, "deadband": 0.5, "deadband_pct": 2, "max_silence": 900}}
+round rounds the value to that many decimals, a new value is only sent
+when it differs from the last one sent by at least every deadband given,
+unless max_silence seconds have passed since the last one sent.
+
+When the controller gives the node a rate_limit (TokenBucket), driver
+reports beyond it are held and the latest value of each held driver is
+sent as soon as tokens are available again (trailing edge), or before the
+node reports a command.
+"""
+
+import udi_interface
+import logging
+import threading
+import time
+
+LOGGER = udi_interface.LOGGER
+
+
+class MQNode(udi_interface.Node):
+    driver_filters = {}
+    rate_limit = None
+    # subscription QoS of the status topics, 1 for types reporting state changes
+    qos = 0
+    # last level of a second status topic next to status_topic, e.g. 'RESULT'; see status_topics
+    extra_status = None
+    # when the node last received a message, a retained one, and when its restored snapshot state was saved
+    updated_at = None
+    retained_at = None
+    restored_at = None
+
+    def __init__(self, polyglot, primary, address, name):
+        super().__init__(polyglot, primary, address, name)
+        self.driver_sent_at = {}
+        self.updates_sent = 0
+        self.updates_suppressed = 0
+        self.held = set()
+        self.held_lock = threading.Lock()
+        self.release_timer = None
+        self.reports_limited = 0
+
+    @classmethod
+    def status_topics(cls, dev) -> tuple:
+        """
+        Every status topic a device of this type is subscribed to, derived
+        once when DeviceTable compiles the configuration.  Sets the device's
+        extra_status_topic for types that have one.
+        """
+        topic = dev['status_topic']
+        if cls.extra_status is None:
+            return (topic,)
+        extra_status_topic = topic.rsplit('/', 1)[0] + '/' + cls.extra_status
+        if cls.extra_status == 'STATUS10':
+            # the QUERY response of Tasmota sensors is published under stat/
+            extra_status_topic = extra_status_topic.replace('tele/', 'stat/')
+        dev['extra_status_topic'] = extra_status_topic
+        return (topic, extra_status_topic)
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None, text=None):
+        rule = self.driver_filters.get(driver)
+        if rule is not None:
+            value = self._round(value, rule)
+            if report and not force:
+                if self._within_deadband(driver, value, rule):
+                    self.updates_suppressed += 1
+                    return False
+                force = self._silent_too_long(driver, rule)
+        changed = super().setDriver(driver, value, report, force, uom, text)
+        if report and (changed or force):
+            self.updates_sent += 1
+            self.driver_sent_at[driver] = time.monotonic()
+        return changed
+
+    @staticmethod
+    def _round(value, rule):
+        if 'round' not in rule:
+            return value
+        try:
+            precision = int(rule['round'])
+            value = round(float(value), precision)
+        except (TypeError, ValueError):
+            return value
+        return int(value) if precision <= 0 else value
+
+    def _within_deadband(self, driver, value, rule) -> bool:
+        """ True when value is too close to the value last sent to be worth sending """
+        if 'deadband' not in rule and 'deadband_pct' not in rule:
+            return False
+        current = next((drv['value'] for drv in self.drivers if drv['driver'] == driver), None)
+        try:
+            delta = abs(float(value) - float(current))
+            current = abs(float(current))
+        except (TypeError, ValueError):
+            return False
+        if delta == 0:
+            return False  # unchanged, setDriver already sends nothing
+        if 'deadband' in rule and delta < float(rule['deadband']):
+            return not self._silent_too_long(driver, rule)
+        if 'deadband_pct' in rule and delta < current * float(rule['deadband_pct']) / 100:
+            return not self._silent_too_long(driver, rule)
+        return False
+
+    def _silent_too_long(self, driver, rule) -> bool:
+        if 'max_silence' not in rule:
+            return False
+        sent_at = self.driver_sent_at.get(driver)
+        return sent_at is None or time.monotonic() - sent_at >= float(rule['max_silence'])
+
+    def reportDriver(self, driver, force=False):
+        if self.rate_limit is not None:
+            with self.held_lock:
+                if self.held or not self.rate_limit.take():
+                    # its latest value goes out on release
+                    self.reports_limited += 1
+                    self._hold(driver)
+                    return
+        self._send_driver(driver, force)
+
+    def _hold(self, driver):
+        """ called with held_lock """
+        self.held.add(driver)
+        if self.release_timer is None:
+            self.release_timer = threading.Timer(self.rate_limit.wait_time(), self._release)
+            self.release_timer.daemon = True
+            self.release_timer.start()
+
+    def _release(self):
+        """ send the current value of held drivers, as far as tokens allow """
+        with self.held_lock:
+            self.release_timer = None
+            held, self.held = self.held, set()
+            ready = []
+            for driver in held:
+                if self.rate_limit.take():
+                    ready.append(driver)
+                else:
+                    self._hold(driver)
+        for driver in ready:
+            self._send_driver(driver, False)
+
+    def _send_driver(self, driver, force):
+        batcher = self._status_batcher()
+        if batcher is None:
+            return super().reportDriver(driver, force)
+        for drv in self.drivers:
+            if drv['driver'] == driver:
+                batcher.add(self._status_entry(drv))
+                return
+
+    def reportCmd(self, command, value=None, uom=None):
+        """
+        Driver updates held by the rate limit or still in the batcher go
+        first, so programs see the state that caused the command.
+        """
+        self._release_all()
+        batcher = self._status_batcher()
+        if batcher is not None:
+            batcher.flush(self.address)
+        super().reportCmd(command, value, uom)
+
+    def _release_all(self):
+        """ send every held driver now, tokens or not; commands are rare next to driver reports """
+        with self.held_lock:
+            if self.release_timer is not None:
+                self.release_timer.cancel()
+                self.release_timer = None
+            held, self.held = self.held, set()
+        for driver in held:
+            self._send_driver(driver, False)
+
+    def reportDrivers(self):
+        batcher = self._status_batcher()
+        if batcher is None:
+            return super().reportDrivers()
+        LOGGER.debug(f'Updating All Drivers to ISY for {self.name}({self.address})')
+        for drv in self.drivers:
+            batcher.add(self._status_entry(drv))
+
+    def log_error(self, message, *args):
+        """ error on the message path, repeats for this node are rate limited """
+        self._log(logging.ERROR, message, *args)
+
+    def log_warning(self, message, *args):
+        self._log(logging.WARNING, message, *args)
+
+    def _log(self, level, message, *args):
+        limiter = getattr(self.poly.getNode(self.primary), 'log_limiter', None)
+        if limiter is None:
+            LOGGER.log(level, message, *args)
+        else:
+            limiter.log(level, f'{self.address}: {message}', message, *args)
+
+    def _status_batcher(self):
+        controller = self.poly.getNode(self.primary)
+        return getattr(controller, 'status_batcher', None)
+
+    def _status_entry(self, drv) -> dict:
+        return {
+            'address': self.address,
+            'driver': drv['driver'],
+            'value': str(drv['value']),
+            'uom': drv['uom'],
+            'text': drv.get('text'),
+        }
@@ -7,12 +7,17 @@ node MQSensor
 """
 
 import udi_interface
+from nodes import MQNode
 import json
 
 LOGGER = udi_interface.LOGGER
 
-class MQSensor(udi_interface.Node):
+class MQSensor(MQNode):
     id = 'mqsens'
+    payload_json = True
+    coalesce = False
+    query_priority = 1
+    qos = 1
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -33,11 +38,10 @@ class MQSensor(udi_interface.Node):
         self.on = False
         self.motion = False
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload as Json: {} {}".format(ex, payload))
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
 
         # motion detector
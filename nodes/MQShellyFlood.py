@@ -11,11 +11,22 @@ node MQShellyFlood
 """
 
 import udi_interface
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQShellyFlood(udi_interface.Node):
+class MQShellyFlood(MQNode):
     id = 'mqshflood'
+    payload_json = False
+    coalesce = False
+    query_priority = 1
+    qos = 1
+
+    @classmethod
+    def status_topics(cls, dev) -> tuple:
+        # single (wildcard) topic, e.g. .../sensor/+, or a list of them
+        topic = dev['status_topic']
+        return (topic,) if isinstance(topic, str) else tuple(topic)
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -33,8 +44,10 @@ class MQShellyFlood(udi_interface.Node):
         self.on = False
         self.device = device
 
-    def updateInfo(self, payload, topic: str):
-        LOGGER.debug(f"Attempting to handle message for Shelly on topic {topic} with payload {payload}")
+    def updateInfo(self, message):
+        payload = message.text
+        topic = message.topic
+        LOGGER.debug("Attempting to handle message for Shelly on topic %s with payload %s", topic, payload)
         topic_suffix = topic.split('/')[-1]
         self.setDriver("ST", 1)
         if topic_suffix == "temperature":
@@ -47,7 +60,7 @@ class MQShellyFlood(udi_interface.Node):
         elif topic_suffix == "error":
             self.setDriver("GPV", payload)
         else:
-            LOGGER.warn(f"Unable to handle data for topic {topic}")
+            self.log_warning("Unable to handle data for topic %s", topic)
 
     def query(self, command=None):
         """
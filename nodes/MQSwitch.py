@@ -7,12 +7,17 @@ node MQswitch
 """
 
 import udi_interface
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
 
-class MQSwitch(udi_interface.Node):
+class MQSwitch(MQNode):
     id = 'MQSW'
+    payload_json = False
+    coalesce = False
+    query_priority = 0
+    qos = 1
 
     """
     This is the class that all the Nodes will be represented by. You will
@@ -52,19 +57,20 @@ class MQSwitch(udi_interface.Node):
         self.cmd_topic = device["cmd_topic"]
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
+        payload = message.text
         if payload == "ON":
+            self.setDriver("ST", 100)
             if not self.on:
                 self.reportCmd("DON")
                 self.on = True
-            self.setDriver("ST", 100)
         elif payload == "OFF":
+            self.setDriver("ST", 0)
             if self.on:
                 self.reportCmd("DOF")
                 self.on = False
-            self.setDriver("ST", 0)
         else:
-            LOGGER.error("Invalid payload {}".format(payload))
+            self.log_error("Invalid payload %s", payload)
 
     def cmd_on(self, command):
         self.on = True
@@ -7,13 +7,18 @@ node MQTrigger
 """
 
 import udi_interface
+from nodes import MQNode
 import urllib3
 
 LOGGER = udi_interface.LOGGER
 
 
-class MQTrigger(udi_interface.Node):
+class MQTrigger(MQNode):
     id = 'MQTG'
+    payload_json = False
+    coalesce = False
+    query_priority = 1
+    qos = 1
 
     """
     This is the class that all the Nodes will be represented by. You will
@@ -54,7 +59,8 @@ class MQTrigger(udi_interface.Node):
         self.status_topic = device["status_topic"]
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
+        payload = message.text
         if payload == "ON":
             if not self.on:
                 self.reportCmd("DON")
@@ -66,7 +72,7 @@ class MQTrigger(udi_interface.Node):
                 self.on = False
             # self.setDriver("ST", 0)
         else:
-            LOGGER.error("Invalid payload {}".format(payload))
+            self.log_error("Invalid payload %s", payload)
 
     def cmd_on(self, command):
         self.http = urllib3.PoolManager()
@@ -10,12 +10,17 @@ Currently, supports the BME280.  Could be extended to accept others.
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQbme(udi_interface.Node):
+class MQbme(MQNode):
     id = 'mqbme'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
+    extra_status = 'STATUS10'
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -41,13 +46,12 @@ class MQbme(udi_interface.Node):
         LOGGER.debug(f'CMD_ID {self.sensor_id}, {self.cmd_topic}')
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload as Json: {} {}".format(ex, payload))
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
-        LOGGER.debug(f'BBB {self.sensor_id}, {data} ')
+        LOGGER.debug('BBB %s, %s', self.sensor_id, data)
         if 'StatusSNS' in data:
             data = data['StatusSNS']
         if self.sensor_id in data:
@@ -73,7 +77,7 @@ class MQbme(udi_interface.Node):
         LOGGER.debug(f'QUERY: {self.sensor_id}')
         query_topic = self.cmd_topic.rsplit('/', 1)[0] + '/Status'
         LOGGER.debug(f'QT: {query_topic}')
-        self.controller.mqtt_pub(query_topic, " 10")
+        self.controller.query_status(query_topic)
         self.reportDrivers()
         
     # all the drivers - for reference
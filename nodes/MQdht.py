@@ -10,12 +10,17 @@ It was originally developed with an AM2301
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQdht(udi_interface.Node):
+class MQdht(MQNode):
     id = 'mqdht'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
+    extra_status = 'STATUS10'
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -41,13 +46,12 @@ class MQdht(udi_interface.Node):
         LOGGER.debug(f'CMD_ID {self.sensor_id}, {self.cmd_topic}')
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload as Json: {} {}".format(ex, payload))
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
-        LOGGER.debug(f'ZZZ {self.sensor_id}, {data} ')
+        LOGGER.debug('ZZZ %s, %s', self.sensor_id, data)
         if 'StatusSNS' in data:
             data = data['StatusSNS']
         if self.sensor_id in data:
@@ -69,7 +73,7 @@ class MQdht(udi_interface.Node):
         LOGGER.debug(f'QUERY: {self.sensor_id}')
         query_topic = self.cmd_topic.rsplit('/', 1)[0] + '/Status'
         LOGGER.debug(f'QT: {query_topic}')
-        self.controller.mqtt_pub(query_topic, " 10")
+        self.controller.query_status(query_topic)
         self.reportDrivers()
         
     # all the drivers - for reference
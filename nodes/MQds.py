@@ -10,12 +10,17 @@ was made for DS18B20 waterproof
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQds(udi_interface.Node):
+class MQds(MQNode):
     id = 'mqds'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
+    extra_status = 'STATUS10'
 
     """
     This is the class that all the Nodes will be represented by. You will
@@ -44,13 +49,12 @@ class MQds(udi_interface.Node):
     def start(self):
         pass
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload as Json: {} {}".format(ex, payload))
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
-        LOGGER.debug(f'YYY {self.sensor_id}, {data} ')
+        LOGGER.debug('YYY %s, %s', self.sensor_id, data)
         if 'StatusSNS' in data:
             data = data['StatusSNS']
         if self.sensor_id in data:
@@ -72,7 +76,7 @@ class MQds(udi_interface.Node):
         LOGGER.debug(f'QUERY: {self.sensor_id}')
         query_topic = self.cmd_topic.rsplit('/', 1)[0] + '/Status'
         LOGGER.debug(f'QT: {query_topic}')
-        self.controller.mqtt_pub(query_topic, " 10")
+        self.controller.query_status(query_topic)
         self.reportDrivers()
         
     # all the drivers - for reference
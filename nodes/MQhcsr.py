@@ -10,12 +10,16 @@ node MQhcsr
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQhcsr(udi_interface.Node):
+class MQhcsr(MQNode):
     id = 'mqhcsr'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -32,13 +36,10 @@ class MQhcsr(udi_interface.Node):
         super().__init__(polyglot, primary, address, name)
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error(
-                "Failed to parse MQTT Payload as Json: {} {}".format(ex, payload)
-            )
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
         if "SR04" in data:
             self.setDriver("ST", 1)
@@ -10,11 +10,22 @@ Able to control door, light, lock and get status of same as well as motion, obst
 """
 
 import udi_interface
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQratgdo(udi_interface.Node):
+class MQratgdo(MQNode):
     id = 'mqratgdo'
+    payload_json = False
+    coalesce = False
+    query_priority = 0
+    qos = 1
+    # subscribed as <status_topic>/status/<name>
+    STATUS = ('availability', 'light', 'door', 'motion', 'lock', 'obstruction')
+
+    @classmethod
+    def status_topics(cls, dev) -> tuple:
+        return tuple(f"{dev['status_topic']}/status/{status}" for status in cls.STATUS)
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -53,7 +64,9 @@ class MQratgdo(udi_interface.Node):
             if self.motion == True:
                 self.m_clear()
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
+        payload = message.text
+        topic = message.topic
         topic_suffix = topic.split('/')[-1]
         if topic_suffix == "availability":
             value = int(payload == "online")
@@ -84,7 +97,7 @@ class MQratgdo(udi_interface.Node):
             value = int(payload == "obstructed")
             self.setDriver("GV4", value)
         else:
-            LOGGER.warn(f"Unable to handle data for topic {topic}")
+            self.log_warning("Unable to handle data for topic %s", topic)
 
     def lt_on(self, command):
         self.controller.mqtt_pub(self.cmd_topic + "light", "on")
@@ -8,11 +8,16 @@ node MQraw
 """
 
 import udi_interface
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQraw(udi_interface.Node):
+class MQraw(MQNode):
     id = 'mqr'
+    payload_json = False
+    coalesce = False
+    query_priority = 1
+    qos = 1
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -30,12 +35,13 @@ class MQraw(udi_interface.Node):
         self.cmd_topic = device["cmd_topic"]
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
+    def updateInfo(self, message):
+        payload = message.text
         try:
             self.setDriver("ST", 1)
             self.setDriver("GV1", int(payload))
         except Exception as ex:
-            LOGGER.error("Failed to parse MQTT Payload: {} {}".format(ex, payload))
+            self.log_error("Failed to parse MQTT Payload: %s %s", ex, payload)
 
     def query(self, command=None):
         """
@@ -9,12 +9,16 @@ node MQs31
 """
 
 import udi_interface
-import json
+from nodes import MQNode
 
 LOGGER = udi_interface.LOGGER
 
-class MQs31(udi_interface.Node):
+class MQs31(MQNode):
     id = 'mqs31'
+    payload_json = True
+    coalesce = True
+    query_priority = 1
+    qos = 0
     
     """
     This is the class that all the Nodes will be represented by. You will
@@ -31,13 +35,10 @@ class MQs31(udi_interface.Node):
         super().__init__(polyglot, primary, address, name)
         self.on = False
 
-    def updateInfo(self, payload, topic: str):
-        try:
-            data = json.loads(payload)
-        except Exception as ex:
-            LOGGER.error(
-                "Failed to parse MQTT Payload as Json: {} {}".format(ex, payload)
-            )
+    def updateInfo(self, message):
+        data = message.data
+        if data is None:
+            self.log_error("Failed to parse MQTT Payload as Json: %s", message.text)
             return False
         if "ENERGY" in data:
             self.setDriver("ST", 1)
@@ -0,0 +1,165 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+Metrics
+
+Small in-process metrics registry: counters, gauges and fixed-bucket
+histograms, optionally labelled, rendered in the Prometheus text format
+and written to a local file.
+"""
+
+import udi_interface
+import threading
+
+from nodes import write_atomic
+
+LOGGER = udi_interface.LOGGER
+
+# seconds, suits per-message processing times
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in key) + '}'
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_labels(labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self.values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, help, source=None):
+        """ :param source: callable returning the value, read when rendered """
+        super().__init__(name, help)
+        self.source = source
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[_labels(labels)] = value
+
+    def samples(self):
+        if self.source is not None:
+            try:
+                self.set(self.source())
+            except Exception as ex:
+                LOGGER.error(f'metrics: reading {self.name} failed: {ex}')
+        return super().samples()
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def totals(self):
+        """ (sum, count) over all labels """
+        with self._lock:
+            return (sum(entry[-2] for entry in self.values.values()),
+                    sum(entry[-1] for entry in self.values.values()))
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in self.values.items():
+                cumulative = 0
+                for i, bound in enumerate(self.buckets):
+                    cumulative += entry[i]
+                    samples.append((self.name + '_bucket', key + (('le', repr(bound)),), cumulative))
+                samples.append((self.name + '_bucket', key + (('le', '+Inf'),), entry[-1]))
+                samples.append((self.name + '_sum', key, entry[-2]))
+                samples.append((self.name + '_count', key, entry[-1]))
+        return samples
+
+
+class Metrics(object):
+
+    def __init__(self, prefix='mqtt_'):
+        self.prefix = prefix
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args):
+        name = self.prefix + name
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, help) -> Counter:
+        return self._register(Counter, name, help)
+
+    def gauge(self, name, help, source=None) -> Gauge:
+        return self._register(Gauge, name, help, source)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, buckets)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ replace path atomically so a scraper never reads a partial file """
+        text = self.render()
+        try:
+            write_atomic(path, lambda f: f.write(text))
+        except OSError as ex:
+            LOGGER.error(f'metrics: failed to write {path}: {ex}')
@@ -0,0 +1,89 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+QueryScheduler
+
+Spreads node queries over a window instead of firing them all at once
+after a (re)connect.  Queries are sent in priority order (lowest first),
+spaced evenly over the window but never faster than max_rate per second,
+with random jitter so that devices do not all answer at the same moment.
+"""
+
+import udi_interface
+import threading
+import random
+import time
+
+LOGGER = udi_interface.LOGGER
+
+
+class QueryScheduler(object):
+
+    def __init__(self, window=10.0, max_rate=20.0, jitter=0.5, on_progress=None, name='queries'):
+        """
+        :param window: seconds over which a round of queries is spread
+        :param max_rate: maximum queries per second
+        :param jitter: fraction of the spacing added at random to each query
+        :param on_progress: callable(done, total) after every query
+        """
+        self.window = float(window)
+        self.max_rate = float(max_rate)
+        self.jitter = float(jitter)
+        self.on_progress = on_progress
+        self.name = name
+        self.done = 0
+        self.total = 0
+        self._cancel = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def schedule(self, nodes, priority=lambda node: 0):
+        """ start a new round of queries, replacing any round in progress """
+        ordered = sorted(nodes, key=priority)
+        with self._lock:
+            self.cancel()
+            self._cancel = threading.Event()
+            self.done = 0
+            self.total = len(ordered)
+            self._thread = threading.Thread(target=self._run, args=[ordered, self._cancel],
+                                            name=self.name, daemon=True)
+            self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(5)
+        self._thread = None
+
+    def progress(self) -> int:
+        """ percent of the current round sent """
+        return 100 if self.total == 0 else int(100 * self.done / self.total)
+
+    def _run(self, nodes, cancel):
+        if not nodes:
+            self._report()
+            return
+        spacing = max(self.window / len(nodes), 1.0 / self.max_rate if self.max_rate > 0 else 0.0)
+        started = time.monotonic()
+        for i, node in enumerate(nodes):
+            due = started + i * spacing + random.uniform(0, self.jitter * spacing)
+            if cancel.wait(max(0.0, due - time.monotonic())):
+                LOGGER.info(f'{self.name}: cancelled after {self.done} of {self.total}')
+                return
+            try:
+                node.query()
+            except Exception as ex:
+                LOGGER.error(f'{self.name}: query of {node.address} failed: {ex}')
+            self.done += 1
+            self._report()
+        LOGGER.info(f'{self.name}: {self.total} nodes queried in {time.monotonic() - started:.1f}s')
+
+    def _report(self):
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self.done, self.total)
+            except Exception as ex:
+                LOGGER.error(f'{self.name}: progress callback failed: {ex}')
@@ -0,0 +1,58 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+StartupPhases
+
+One event per startup phase (parameters loaded, nodes ready, broker
+connected, subscriptions acknowledged).  Phases complete in whatever order
+the threads driving them finish, waiters wake as soon as theirs is set and
+the time each phase was first reached is logged.
+"""
+
+import udi_interface
+import threading
+import time
+
+LOGGER = udi_interface.LOGGER
+
+
+class StartupPhases(object):
+
+    def __init__(self, phases):
+        self.started = time.monotonic()
+        self.phases = list(phases)
+        self.events = {phase: threading.Event() for phase in self.phases}
+        self.reached = {}
+        self._lock = threading.Lock()
+
+    def mark(self, phase) -> bool:
+        """ phase is (again) complete, True the first time it is reached """
+        with self._lock:
+            first = phase not in self.reached
+            if first:
+                self.reached[phase] = time.monotonic() - self.started
+            self.events[phase].set()
+            complete = first and len(self.reached) == len(self.phases)
+        if first:
+            LOGGER.info(f"startup: {phase} after {self.reached[phase]:.2f}s")
+        if complete:
+            LOGGER.info(f"startup complete: {self.summary()}")
+        return first
+
+    def clear(self, phase):
+        """ phase no longer holds, e.g. connected after a disconnect """
+        self.events[phase].clear()
+
+    def is_set(self, phase) -> bool:
+        return self.events[phase].is_set()
+
+    def wait(self, phase, timeout=None) -> bool:
+        return self.events[phase].wait(timeout)
+
+    def summary(self) -> str:
+        """ phases in the order they were first reached, seconds since start """
+        with self._lock:
+            reached = sorted(self.reached.items(), key=lambda item: item[1])
+        return ', '.join(f"{phase} {elapsed:.2f}s" for phase, elapsed in reached)
@@ -0,0 +1,116 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+StatusBatcher
+
+Collects driver updates from all nodes and sends them to Polyglot as one
+'set' status message instead of one message per setDriver.  A batch is
+sent once no new update has arrived for interval seconds, but never later
+than max_latency after its first update, or as soon as it holds max_batch
+updates.  A newer value for the same node driver replaces the older one
+still waiting in the batch.  A node flushes its own updates before it
+reports a command, so Polyglot gets them in the order they happened.
+"""
+
+import udi_interface
+import threading
+import time
+
+LOGGER = udi_interface.LOGGER
+
+
+class StatusBatcher(object):
+
+    def __init__(self, send, interval=0.1, max_latency=1.0, max_batch=200, name='statusbatch'):
+        """
+        :param send: callable(message, type), normally poly.send
+        :param interval: seconds without a new update before a batch is sent
+        :param max_latency: seconds an update may wait at most
+        :param max_batch: updates after which a batch is sent immediately
+        """
+        self.send = send
+        self.interval = float(interval)
+        self.max_latency = max(float(max_latency), self.interval)
+        self.max_batch = max(1, int(max_batch))
+        self.name = name
+        self.pending = {}  # (address, driver) -> status entry
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.flushes = 0
+        self.updates = 0
+        self.replaced = 0
+        self.largest = 0
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(self.max_latency + 1)
+        self.flush()
+
+    def add(self, entry):
+        """ queue one status entry ({'address', 'driver', 'value', 'uom', 'text'}) """
+        now = time.monotonic()
+        with self._cond:
+            key = (entry['address'], entry['driver'])
+            if not self.pending:
+                self.first_at = now
+            elif key in self.pending:
+                self.replaced += 1
+            self.pending[key] = entry
+            self.last_at = now
+            full = len(self.pending) >= self.max_batch
+            self._cond.notify()
+        if full:
+            self.flush()
+
+    def flush(self, address=None):
+        """ send the pending updates now, only those of one node when address is given """
+        with self._send_lock:
+            with self._cond:
+                if address is None:
+                    batch = list(self.pending.values())
+                    self.pending = {}
+                else:
+                    keys = [key for key in self.pending if key[0] == address]
+                    batch = [self.pending.pop(key) for key in keys]
+            if not batch:
+                return
+            self.flushes += 1
+            self.updates += len(batch)
+            self.largest = max(self.largest, len(batch))
+            self.send({'set': batch}, 'status')
+
+    def take_stats(self):
+        """ (flushes, updates, largest flush) since the previous call """
+        with self._send_lock:
+            stats = (self.flushes, self.updates, self.largest)
+            self.flushes = self.updates = self.largest = 0
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self.pending and not self._stop.is_set():
+                    self._cond.wait()
+                while self.pending and not self._stop.is_set():
+                    due = min(self.last_at + self.interval, self.first_at + self.max_latency)
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+            try:
+                self.flush()
+            except Exception as ex:
+                LOGGER.error(f'{self.name}: flush failed: {ex}')
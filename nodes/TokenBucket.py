@@ -0,0 +1,48 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+TokenBucket
+
+Rate limiter allowing bursts of up to burst operations, refilled at rate
+operations per second.
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=10):
+        """
+        :param rate: tokens added per second
+        :param burst: most tokens the bucket holds
+        """
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, count=1) -> bool:
+        """ use count tokens if available """
+        with self._lock:
+            self._refill()
+            if self.tokens >= count:
+                self.tokens -= count
+                return True
+            return False
+
+    def wait_time(self, count=1) -> float:
+        """ seconds until count tokens are available """
+        with self._lock:
+            self._refill()
+            missing = count - self.tokens
+            return 0.0 if missing <= 0 else missing / self.rate
@@ -0,0 +1,127 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+TopicTrie
+
+Maps MQTT topic filters (literal or with + / # wildcards) to values and
+resolves an incoming topic to the most specific matching filter, along
+with the topic segments captured by the wildcards.  A lookup walks one
+level per topic segment, so its cost depends on topic depth and not on
+how many filters are stored.
+"""
+
+from typing import Any, Optional, Tuple
+
+
+class _TrieNode(object):
+    __slots__ = ('children', 'value', 'filter')
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+        self.filter = None
+
+
+class TopicTrie(object):
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.count = 0
+
+    @staticmethod
+    def is_wildcard(topic_filter: str) -> bool:
+        return '+' in topic_filter or '#' in topic_filter
+
+    @staticmethod
+    def valid_filter(topic_filter: str) -> bool:
+        """ '+' and '#' must fill a whole level and '#' must be the last level """
+        if not topic_filter:
+            return False
+        levels = topic_filter.split('/')
+        for i, level in enumerate(levels):
+            if ('+' in level or '#' in level) and len(level) > 1:
+                return False
+            if level == '#' and i != len(levels) - 1:
+                return False
+        return True
+
+    def add(self, topic_filter: str, value):
+        node = self.root
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, _TrieNode())
+        if node.filter is None:
+            self.count += 1
+        node.value = value
+        node.filter = topic_filter
+
+    def remove(self, topic_filter: str):
+        path = [self.root]
+        levels = topic_filter.split('/')
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].filter is None:
+            return
+        path[-1].value = None
+        path[-1].filter = None
+        self.count -= 1
+        # prune empty branches
+        for depth in range(len(levels), 0, -1):
+            if path[depth].children or path[depth].filter is not None:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+
+    def get(self, topic_filter: str, default=None):
+        """ exact filter lookup, no wildcard matching """
+        node = self.root
+        for level in topic_filter.split('/'):
+            node = node.children.get(level)
+            if node is None:
+                return default
+        return node.value if node.filter is not None else default
+
+    def match(self, topic: str) -> Tuple[Optional[Any], Tuple[str, ...]]:
+        """
+        Returns (value, captured segments) for the most specific filter
+        matching topic, a literal level wins over '+' which wins over '#'.
+        (None, ()) if nothing matches.
+        """
+        found = self._match(self.root, topic.split('/'), 0, ())
+        return found if found is not None else (None, ())
+
+    def _match(self, node, levels, i, captures):
+        if i == len(levels):
+            if node.filter is not None:
+                return node.value, captures
+            multi = node.children.get('#')  # 'a/#' also matches 'a'
+            if multi is not None and multi.filter is not None:
+                return multi.value, captures
+            return None
+        level = levels[i]
+        child = node.children.get(level)
+        if child is not None:
+            found = self._match(child, levels, i + 1, captures)
+            if found is not None:
+                return found
+        child = node.children.get('+')
+        if child is not None:
+            found = self._match(child, levels, i + 1, captures + (level,))
+            if found is not None:
+                return found
+        child = node.children.get('#')
+        if child is not None and child.filter is not None:
+            return child.value, captures + ('/'.join(levels[i:]),)
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, topic_filter):
+        return self.get(topic_filter, _MISSING) is not _MISSING
+
+
+_MISSING = object()
@@ -0,0 +1,90 @@
+"""
+mqtt-poly-pg3x NodeServer/Plugin for EISY/Polisy
+
+(C) 2024
+
+WorkerPool
+
+Bounded ingestion queue feeding a pool of worker threads.  Items are
+sharded by key (the node address) so that messages for one device are
+always handled in order by the same worker, while different devices are
+processed in parallel.  Keeps paho's network thread free of parsing,
+routing and setDriver work.
+"""
+
+import udi_interface
+import threading
+import queue
+import zlib
+
+LOGGER = udi_interface.LOGGER
+
+
+class WorkerPool(object):
+
+    def __init__(self, handler, workers=2, queue_size=1000, name='mqworker'):
+        """
+        :param handler: callable run by a worker for every submitted item
+        :param workers: number of worker threads (shards)
+        :param queue_size: total number of items that may be waiting
+        """
+        self.handler = handler
+        self.name = name
+        self.workers = max(1, int(workers))
+        shard_size = max(1, int(queue_size) // self.workers)
+        self.queues = [queue.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self.threads = []
+        self.submitted = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(target=self._run, args=[q], name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self.threads.append(t)
+        LOGGER.info(f'{self.name}: started {self.workers} workers')
+
+    def stop(self, timeout=2.0):
+        for q in self.queues:
+            try:
+                q.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+
+    def submit(self, key, item) -> bool:
+        """
+        Queue item on the shard for key; never blocks the caller.
+        Returns False (and counts a drop) when that shard is full.
+        """
+        q = self.queues[self._shard(key)]
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def _shard(self, key) -> int:
+        if self.workers == 1:
+            return 0
+        return zlib.crc32(str(key).encode()) % self.workers
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            try:
+                self.handler(item)
+            except Exception as ex:
+                LOGGER.error(f'{self.name}: failed to process {item}: {ex}')
@@ -1,6 +1,21 @@
 
 """ Node classes used by the Python template Node Server. """
 
+from .AtomicFile      import write_atomic
+from .Envelope        import Envelope
+from .WorkerPool      import WorkerPool
+from .Coalescer       import Coalescer
+from .TopicTrie       import TopicTrie
+from .QueryScheduler  import QueryScheduler
+from .StatusBatcher   import StatusBatcher
+from .TokenBucket     import TokenBucket
+from .LogLimiter      import LogLimiter
+from .Metrics         import Metrics
+from .StartupPhases   import StartupPhases
+from .Backoff         import Backoff
+from .DriverSnapshot  import DriverSnapshot
+from .DeviceTable     import DeviceTable
+from .MQNode          import MQNode
 from .MQSwitch        import MQSwitch
 from .MQDimmer        import MQDimmer
 from .MQFan           import MQFan